@@ -0,0 +1,59 @@
+"""Cleaning the descriptions of a full snap.fan card and location list"""
+
+import random
+from time import perf_counter
+
+from whatno.extension.helpers import CleanHTML, HTMLCleaner
+
+from .conftest import bench_size
+
+CARDS = bench_size("CARDS", 600)
+LOCATIONS = bench_size("LOCATIONS", 300)
+# rounds of card list payloads, the same descriptions come back every refresh
+ROUNDS = bench_size("HTML_ROUNDS", 20)
+
+TEMPLATES = [
+    "<b>On Reveal:</b> Give your other cards here +{n} Power.",
+    "<b>Ongoing:</b> Your cards at this location have +{n} Power.",
+    "<i>No ability</i>",
+    "<p>When this is discarded, add a {n}-Power copy to your hand.</p>",
+    "<span class='keyword'>Activate:</span> Move this to another location.<br/>",
+    "After each turn, add a Rock to your opponent&#39;s deck. <b>{n}</b>",
+    "Cards can&#39;t be played here &amp; cards here can&#39;t move.",
+    'Draw a card. <a href="https://snap.fan/keywords/destroy">Destroy</a> it.',
+]
+
+
+def _payload(kind, count, rand):
+    """Descriptions that differ per card, like the real ones do"""
+    return [
+        f"{rand.choice(TEMPLATES).format(n=rand.randint(1, 6))} <i>{kind} {idx}</i>"
+        for idx in range(count)
+    ]
+
+
+def test_card_list_cleaning():
+    rand = random.Random(27)
+    payload = _payload("card", CARDS, rand) + _payload("location", LOCATIONS, rand)
+
+    start = perf_counter()
+    for _ in range(ROUNDS):
+        expected = [CleanHTML().process(desc) for desc in payload]
+    parser = perf_counter() - start
+
+    cleaner = HTMLCleaner()
+    start = perf_counter()
+    cleaned = cleaner.process_many(payload)
+    first = perf_counter() - start
+    for _ in range(ROUNDS - 1):
+        cleaned = cleaner.process_many(payload)
+    batch = perf_counter() - start
+
+    print(
+        f"\n{ROUNDS} card lists of {len(payload)} descriptions, "
+        f"CleanHTML per description {parser:.3f}s, "
+        f"process_many {batch:.3f}s ({first:.3f}s for the first list), "
+        f"{cleaner.hits} cache hits {cleaner.misses} misses"
+    )
+    assert cleaned == expected
+    assert batch < parser
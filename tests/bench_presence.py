@@ -0,0 +1,55 @@
+"""Throughput of presence updates through the stats cog, coalescing and flushing"""
+
+# the benchmarks drive the cog the way its listeners and loops do
+# pylint: disable=protected-access
+
+import random
+from time import perf_counter
+from types import SimpleNamespace
+
+from discord import Activity, ActivityType, Game
+
+from .conftest import bench_size
+
+USERS = bench_size("PRESENCE_USERS", 5000)
+UPDATES = bench_size("PRESENCE_UPDATES", 200_000)
+GAMES = [Game(f"game {idx}") for idx in range(50)]
+SONGS = [Activity(type=ActivityType.listening, name=f"song {idx}") for idx in range(500)]
+
+
+def _members():
+    """Members whose activities change on every update, the same game with
+    a new song, or a different game, or nothing at all"""
+    rand = random.Random(43)
+    members = [SimpleNamespace(id=user, bot=False, activities=()) for user in range(USERS)]
+    updates = []
+    for _ in range(UPDATES):
+        activities = rand.choice(
+            ((), (rand.choice(GAMES),), (rand.choice(GAMES), rand.choice(SONGS)))
+        )
+        updates.append(SimpleNamespace(**{**vars(rand.choice(members)), "activities": activities}))
+    return updates
+
+
+def test_presence_throughput(run_stats):
+    updates = _members()
+
+    async def bench(cog):
+        start = perf_counter()
+        for member in updates:
+            await cog.presence_change(None, member)
+        flushed = await cog._flush_presence()
+        elapsed = perf_counter() - start
+        with cog._database(readonly=True) as db:
+            written = db.execute("SELECT count(*) AS total FROM Activity").fetchone()["total"]
+            opened = db.execute("SELECT count(*) AS total FROM OpenActivity").fetchone()["total"]
+        return elapsed, flushed, written, opened, sum(map(len, cog.presence.open.values()))
+
+    elapsed, flushed, written, opened, tracked = run_stats(bench)
+    print(
+        f"\n{UPDATES} presence updates from {USERS} users in {elapsed:.2f}s, "
+        f"{UPDATES / elapsed:,.0f}/s, {written} activity sessions written, "
+        f"{opened} open, last flush {flushed} rows"
+    )
+    assert opened == tracked
+    assert UPDATES / elapsed > 1000
@@ -0,0 +1,45 @@
+"""Per message cost of the sqlite time strings written by a `txt gd` backfill"""
+
+import random
+from datetime import datetime
+from time import perf_counter
+
+from whatno.extension.cog_stats import HISTORY_CHUNK
+from whatno.extension.helpers import DAY_SECS, TimeTravel
+
+from .conftest import bench_size
+
+MESSAGES = bench_size("MESSAGES", 200_000)
+
+
+def _aware(ts):
+    """How every row was converted before the batch api, an aware datetime
+    and strftime per timestamp"""
+    return datetime.fromtimestamp(ts, tz=TimeTravel.tz).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+
+
+def _chunks():
+    """Message timestamps over two years, newest first, in the chunks the
+    backfill writes them"""
+    rand = random.Random(26)
+    now = TimeTravel.timestamp()
+    stamps = sorted((now - rand.uniform(0, 730 * DAY_SECS) for _ in range(MESSAGES)), reverse=True)
+    return [stamps[idx : idx + HISTORY_CHUNK] for idx in range(0, MESSAGES, HISTORY_CHUNK)]
+
+
+def _time(convert, chunks):
+    start = perf_counter()
+    converted = [convert(chunk) for chunk in chunks]
+    return perf_counter() - start, converted
+
+
+def test_backfill_timestamps():
+    chunks = _chunks()
+    aware, expected = _time(lambda chunk: [_aware(ts) for ts in chunk], chunks)
+    single, per_row = _time(lambda chunk: [TimeTravel.sqlts(ts) for ts in chunk], chunks)
+    batch, batched = _time(TimeTravel.sqlts_many, chunks)
+    print(f"\n{MESSAGES} timestamps in chunks of {HISTORY_CHUNK}, per row:")
+    for name, elapsed in (("aware datetime", aware), ("sqlts", single), ("sqlts_many", batch)):
+        print(f"  {name:>14}: {elapsed / MESSAGES * 1e6:.2f}us")
+    assert per_row == batched == expected
+    assert batch < aware
@@ -0,0 +1,95 @@
+"""Leaderboard and user totals over a seeded stats database
+
+The request asked for 10M History rows, that takes a while to seed so the
+default is smaller, run with WHATNO_BENCH_HISTORY_ROWS=10000000 for the full size.
+"""
+
+import random
+from time import perf_counter
+
+from whatno.extension.cog_stats import StatDB
+from whatno.extension.helpers import DAY_SECS, TimeTravel
+from whatno.extension.stats_sql import HISTORY_INSERT, TOP_TOTALS, USER_TOTALS, totals_query
+
+from .conftest import bench_size
+
+ROWS = bench_size("HISTORY_ROWS", 500_000)
+USERS = 300
+GUILDS = 3
+STATES = ("voice", "mute", "deaf", "stream", "video")
+WINDOWS = (None, 30, 7, 1)
+REPEAT = 5
+CHUNK = 100_000
+
+
+def _seed(stats):
+    """History rows over two years, each user in one guild, then the deferred
+    migrations build the covering indexes and backfill the rollups like on an
+    existing database"""
+    rand = random.Random(33)
+    now = TimeTravel.timestamp()
+    for offset in range(0, ROWS, CHUNK):
+        rows = []
+        for _ in range(min(CHUNK, ROWS - offset)):
+            start = float(int(now - rand.uniform(0, 730 * DAY_SECS)))
+            user = rand.randrange(USERS)
+            rows.append(
+                (
+                    user,
+                    user % GUILDS,
+                    rand.randrange(50),
+                    rand.choice(STATES),
+                    start,
+                    float(rand.randint(1, 4 * 3600)),
+                    False,
+                )
+            )
+        tscs = TimeTravel.sqlts_many(row[4] for row in rows)
+        with stats as db:
+            db.executemany(HISTORY_INSERT, [(*row, tsc) for row, tsc in zip(rows, tscs)])
+    stats.migrate(deferred=True)
+
+
+def _best(stats, sql, params):
+    """Fastest of a few runs, in milliseconds"""
+    times = []
+    with stats as db:
+        for _ in range(REPEAT):
+            start = perf_counter()
+            db.execute(sql, params).fetchall()
+            times.append(perf_counter() - start)
+    return min(times) * 1000
+
+
+def _queries(stats, rollups):
+    return {
+        "top": _best(stats, *totals_query(TOP_TOTALS, WINDOWS, rollups, guild=1)),
+        "user": _best(stats, *totals_query(USER_TOTALS, WINDOWS, rollups, user=7, guild=1)),
+    }
+
+
+def test_seeded_totals(tmp_path):
+    stats = StatDB(tmp_path / "stats.db")
+    stats.setup()
+    start = perf_counter()
+    _seed(stats)
+    seeded = perf_counter() - start
+
+    timings = {
+        "rollups": _queries(stats, True),
+        "covering index": _queries(stats, False),
+        "early": {
+            "cached": _best(stats, "SELECT ts FROM Timestamps WHERE name = 'early'", ()),
+            "scan": _best(stats, "SELECT starttime FROM History GROUP BY starttime LIMIT 1", ()),
+        },
+    }
+    with stats as db:
+        db.execute("DROP INDEX History_guild_state_start")
+        db.execute("DROP INDEX History_user_guild_start")
+    timings["no index"] = _queries(stats, False)
+
+    print(f"\n{ROWS} History rows seeded in {seeded:.1f}s, best of {REPEAT}:")
+    for name, queries in timings.items():
+        print(f"  {name:>14}: " + ", ".join(f"{key} {ms:.1f}ms" for key, ms in queries.items()))
+    assert timings["rollups"]["top"] < timings["no index"]["top"]
+    assert timings["rollups"]["user"] < timings["no index"]["user"]
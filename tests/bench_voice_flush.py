@@ -0,0 +1,96 @@
+"""500 users in voice at once through the stats cog, events and the flushes
+of the session ledger between them"""
+
+import random
+from statistics import median
+from time import perf_counter
+from types import SimpleNamespace
+
+from .conftest import bench_size
+
+# the benchmarks drive the cog the way its listeners and loops do
+# pylint: disable=protected-access
+
+USERS = bench_size("VOICE_USERS", 500)
+ROUNDS = bench_size("VOICE_ROUNDS", 20)
+GUILDS = 10
+CHANNELS = 5
+
+
+def _state(channel=None, **flags):
+    return SimpleNamespace(
+        channel=channel,
+        self_mute=flags.get("mute", False),
+        self_deaf=flags.get("deaf", False),
+        self_stream=flags.get("stream", False),
+        self_video=flags.get("video", False),
+    )
+
+
+def _channels():
+    return [
+        SimpleNamespace(id=guild * 100 + idx, name=f"vc {idx}", guild=SimpleNamespace(id=guild))
+        for guild in range(1, GUILDS + 1)
+        for idx in range(CHANNELS)
+    ]
+
+
+def test_concurrent_voice_users(run_stats):
+    rand = random.Random(31)
+    channels = _channels()
+    guilds = {}
+    for channel in channels:
+        guilds.setdefault(channel.guild.id, []).append(channel)
+    members = [SimpleNamespace(id=user, name=f"user {user}") for user in range(USERS)]
+
+    async def bench(cog):
+        states = {member.id: _state() for member in members}
+        events = 0
+        event_time = 0.0
+        flushes = []
+
+        async def change(member, after):
+            nonlocal events, event_time
+            start = perf_counter()
+            await cog.voice_change(member, states[member.id], after)
+            event_time += perf_counter() - start
+            states[member.id] = after
+            events += 1
+
+        async def flush():
+            start = perf_counter()
+            written = await cog._flush_dirty()
+            flushes.append((perf_counter() - start, written))
+
+        for member in members:
+            await change(member, _state(rand.choice(channels)))
+        await flush()
+        for _ in range(ROUNDS):
+            for member in members:
+                channel = states[member.id].channel
+                if rand.random() < 0.05:
+                    # moves between channels only happen inside a guild
+                    channel = rand.choice(guilds[channel.guild.id])
+                flags = {flag: rand.random() < 0.3 for flag in ("mute", "deaf", "stream")}
+                await change(member, _state(channel, **flags))
+            await flush()
+        for member in members:
+            await change(member, _state())
+        await flush()
+
+        with cog._database(readonly=True) as db:
+            history = db.execute("SELECT count(*) AS total FROM History").fetchone()["total"]
+            still_open = db.execute("SELECT count(*) AS total FROM OpenSession").fetchone()["total"]
+        return events, event_time, flushes, history, still_open, len(cog.ledger)
+
+    events, event_time, flushes, history, still_open, ledger = run_stats(bench)
+    times = [elapsed for elapsed, _ in flushes]
+    rows = sum(written for _, written in flushes)
+    print(
+        f"\n{USERS} users, {events} voice events in {event_time:.3f}s, "
+        f"{events / event_time:,.0f}/s\n"
+        f"{len(flushes)} flushes of {rows / len(flushes):.0f} sessions on average, "
+        f"median {median(times) * 1000:.1f}ms max {max(times) * 1000:.1f}ms, "
+        f"{rows / sum(times):,.0f} sessions/s, {history} sessions in History"
+    )
+    assert still_open == ledger == 0
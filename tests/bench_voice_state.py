@@ -0,0 +1,139 @@
+"""Memory per tracked user and event throughput of the bitmask voice state,
+against the namedtuple records it replaced"""
+
+import random
+import tracemalloc
+from collections import namedtuple
+from time import perf_counter
+from types import SimpleNamespace
+
+from whatno.extension.cog_stats import StatsCog
+from whatno.extension.stats_state import Voice, VoiceCon
+
+from .conftest import bench_size
+
+USERS = bench_size("STATE_USERS", 10_000)
+EVENTS = bench_size("STATE_EVENTS", 200_000)
+
+# the benchmarks drive the cog the way its listeners and loops do
+# pylint: disable=protected-access
+
+# the records and the code that handled them as they were before the bitmask,
+# one VoiceState per active state
+OldState = namedtuple("VoiceState", ["state", "time"])
+OldVoice = namedtuple("Voice", ["voice", "mute", "deaf", "stream", "video"])
+OldDiff = namedtuple("VoiceDiff", ["voice", "mute", "deaf", "stream", "video"])
+FLAGS = ("self_mute", "self_deaf", "self_stream", "self_video")
+
+
+def _old_start(state, timestamp):
+    return OldVoice(
+        voice=OldState("voice", timestamp),
+        mute=OldState("mute", timestamp) if state.self_mute else None,
+        deaf=OldState("deaf", timestamp) if state.self_deaf else None,
+        stream=OldState("stream", timestamp) if state.self_stream else None,
+        video=OldState("video", timestamp) if state.self_video else None,
+    )
+
+
+def _old_diff(first, second, now):
+    voicediff = second.voice.time - first.voice.time
+
+    mutediff = None
+    if second.mute is not None and first.mute is not None:
+        mutediff = second.mute.time - first.mute.time
+    elif second.mute is None and first.mute is not None:
+        mutediff = now - first.mute.time
+
+    deafdiff = None
+    if second.deaf is not None and first.deaf is not None:
+        deafdiff = second.deaf.time - first.deaf.time
+    elif second.deaf is None and first.deaf is not None:
+        deafdiff = now - first.deaf.time
+
+    streamdiff = None
+    if second.stream is not None and first.stream is not None:
+        streamdiff = second.stream.time - first.stream.time
+    elif second.stream is None and first.stream is not None:
+        streamdiff = now - first.stream.time
+
+    videodiff = None
+    if second.video is not None and first.video is not None:
+        videodiff = second.video.time - first.video.time
+    elif second.video is None and first.video is not None:
+        videodiff = now - first.video.time
+
+    return OldDiff(voicediff, mutediff, deafdiff, streamdiff, videodiff)
+
+
+def _old_new_state(status, before, after):
+    bstate = getattr(before, status)
+    astate = getattr(after, status)
+    nstate = bstate
+    if bstate is None and astate is not None:
+        nstate = astate
+    elif bstate is not None and astate is None:
+        nstate = None
+    return nstate
+
+
+def _old_change(_, before, after, now):
+    """What a voice event did with the old records, minus the database"""
+    _old_diff(before, after, now)
+    voice = _old_new_state("voice", before, after)
+    mute = _old_new_state("mute", before, after)
+    deaf = _old_new_state("deaf", before, after)
+    stream = _old_new_state("stream", before, after)
+    video = _old_new_state("video", before, after)
+    return OldVoice(voice=voice, mute=mute, deaf=deaf, stream=stream, video=video)
+
+
+def _states(rand, count):
+    return [SimpleNamespace(**{flag: rand.random() < 0.3 for flag in FLAGS}) for _ in range(count)]
+
+
+def _memory(start, states):
+    """Bytes per user held in StatsCog.current, the record with its key"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    current = {
+        VoiceCon(user, 1, 10): start(state, 1.7e9 + user * 0.5)
+        for user, state in enumerate(states)
+    }
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / len(current)
+
+
+def _new_change(id_, before, after, now):
+    """What a voice event does with the bitmask records, minus the database"""
+    StatsCog._transition(id_, before, after, now)
+    return StatsCog._merge_state(before, after)
+
+
+def _events_per_sec(start, change, states, events):
+    """Voice events per second, each user starting from their state in `states`"""
+    ids = [VoiceCon(user, 1, 10) for user in range(len(states))]
+    current = {id_: start(state, 0.0) for id_, state in zip(ids, states)}
+    begin = perf_counter()
+    for now, (user, state) in enumerate(events, 1):
+        id_ = ids[user]
+        current[id_] = change(id_, current[id_], start(state, float(now)), float(now))
+    return len(events) / (perf_counter() - begin)
+
+
+def test_voice_state_records():
+    rand = random.Random(37)
+    states = _states(rand, USERS)
+    events = [(rand.randrange(USERS), state) for state in _states(rand, EVENTS)]
+
+    old_bytes = _memory(_old_start, states)
+    new_bytes = _memory(Voice.start, states)
+    old_rate = _events_per_sec(_old_start, _old_change, states, events)
+    new_rate = _events_per_sec(Voice.start, _new_change, states, events)
+
+    print(
+        f"\n{USERS} users, bytes per user: namedtuple {old_bytes:.0f}, bitmask {new_bytes:.0f}\n"
+        f"{EVENTS} events: namedtuple {old_rate:,.0f}/s, bitmask {new_rate:,.0f}/s"
+    )
+    assert new_bytes < old_bytes
@@ -0,0 +1,53 @@
+"""Shared fixtures, and the benchmarks in bench_*.py
+
+The benchmarks are skipped by default, they're collected with the tests when
+WHATNO_BENCH is set or when a bench file is passed directly to pytest. Run them
+with -s to see the numbers, e.g. `WHATNO_BENCH=1 python -m pytest -s tests`.
+"""
+
+import asyncio
+import os
+
+import pytest
+from environs import Env
+
+from whatno.whatnobot import WhatnoBot
+
+
+def pytest_collect_file(file_path, parent):
+    """Collect bench_*.py like test files when WHATNO_BENCH is set"""
+    if (
+        os.environ.get("WHATNO_BENCH")
+        and file_path.suffix == ".py"
+        and file_path.name.startswith("bench_")
+        and not parent.session.isinitpath(file_path)
+    ):
+        return pytest.Module.from_parent(parent, path=file_path)
+    return None
+
+
+def bench_size(name, default):
+    """Size of a benchmark, overridden by the WHATNO_BENCH_<name> variable"""
+    return int(os.environ.get(f"WHATNO_BENCH_{name}", default))
+
+
+@pytest.fixture(name="run_stats")
+def fixture_run_stats(tmp_path, monkeypatch):
+    """Run a coroutine function with the stats cog of a bot that never connects,
+    the cog is unloaded afterwards so anything pending is written"""
+    (tmp_path / "stats").mkdir()
+    monkeypatch.setenv("DISCORD_STATS_DATABASE", "stats.db")
+
+    def run(func):
+        async def main():
+            env = Env()
+            with env.prefixed("DISCORD_"):
+                bot = WhatnoBot("bench", env=env, storage=tmp_path, cogs=["stats"])
+            try:
+                return await func(bot.get_cog("StatsCog"))
+            finally:
+                bot.remove_cog("StatsCog")
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,25 @@
+"""Generations of the query result cache"""
+
+from whatno.extension.helpers import ResultCache
+
+KEY = ("heatmap", 1, None, None)
+
+
+def test_bump_invalidates_guild():
+    cache = ResultCache()
+    cache.put(KEY, "old")
+    cache.put(("heatmap", 2, None, None), "other")
+    cache.bump(1)
+    assert cache.get(KEY) is None
+    assert cache.get(("heatmap", 2, None, None)) == "other"
+
+
+def test_write_during_query_is_not_served():
+    cache = ResultCache()
+    generation = cache.generation(KEY[1])
+    # a flush lands while the query is running in the executor
+    cache.bump(KEY[1])
+    cache.put(KEY, "stale", generation=generation)
+    assert cache.get(KEY) is None
+    cache.put(KEY, "fresh", generation=cache.generation(KEY[1]))
+    assert cache.get(KEY) == "fresh"
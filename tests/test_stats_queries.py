@@ -0,0 +1,118 @@
+"""Stats database migrations and the voice totals queries"""
+
+import random
+
+import pytest
+
+from whatno.extension.cog_stats import StatDB
+from whatno.extension.helpers import DAY_SECS, TimeTravel
+from whatno.extension.stats_sql import (
+    HEARTBEAT,
+    HISTORY_INSERT,
+    OPEN_INSERT,
+    ROLLUP_ADD,
+    TOP_TOTALS,
+    USER_TOTALS,
+    totals_query,
+)
+
+GUILD = 1
+USERS = range(1, 9)
+STATES = ("voice", "mute", "stream")
+WINDOWS = (None, 30, 7, 1)
+
+
+@pytest.fixture(name="stats")
+def fixture_stats(tmp_path):
+    """Stats database with every migration applied, deferred ones included"""
+    database = StatDB(tmp_path / "stats.db")
+    database.setup()
+    database.migrate(deferred=True)
+    return database
+
+
+@pytest.fixture(name="sessions")
+def fixture_sessions(stats):
+    """Closed sessions over the last 40 days written the way a flush writes
+    them, to History and the daily rollups, plus a few open sessions"""
+    rand = random.Random(33)
+    now = TimeTravel.timestamp()
+    closed = []
+    for user in USERS:
+        for _ in range(60):
+            start = float(int(now - rand.uniform(0, 40 * DAY_SECS)))
+            duration = float(rand.randint(1, 4 * 3600))
+            closed.append((user, rand.choice(STATES), start, min(duration, now - start)))
+        # either side of where each window starts, inside its partial first day
+        for days in WINDOWS[1:]:
+            since = int(now - days * DAY_SECS)
+            closed.append((user, "voice", float(since + 60), 600.0))
+            closed.append((user, "mute", float(since - 60), 600.0))
+    with stats as db:
+        db.executemany(
+            HISTORY_INSERT,
+            [
+                (user, GUILD, 10, state, start, duration, False, TimeTravel.sqlts(start))
+                for user, state, start, duration in closed
+            ],
+        )
+        db.executemany(
+            ROLLUP_ADD,
+            [(start, user, GUILD, state, duration) for user, state, start, duration in closed],
+        )
+        for user in USERS[:3]:
+            start = float(int(now - 3600 * user))
+            db.execute(
+                OPEN_INSERT, (user, GUILD, 11, "voice", start, TimeTravel.sqlts(start))
+            ).fetchone()
+        db.execute(HEARTBEAT, (now,))
+    return stats
+
+
+def _plan(stats, query, rollups, **params):
+    sql, params = totals_query(query, WINDOWS, rollups, **params)
+    with stats as db:
+        return [row["detail"] for row in db.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def _totals(stats, query, key, rollups, **params):
+    sql, params = totals_query(query, WINDOWS, rollups, **params)
+    with stats as db:
+        return {
+            row[key]: [row[f"w{idx}"] for idx in range(len(WINDOWS))]
+            for row in db.execute(sql, params)
+        }
+
+
+def test_deferred_migrations_applied(stats):
+    with stats as db:
+        versions = [row["version"] for row in db.execute("SELECT version FROM schema_version")]
+    assert versions == sorted(versions)
+    assert {2, 3, 5, 11} <= set(versions)
+
+
+@pytest.mark.parametrize("rollups", [False, True])
+def test_top_uses_covering_index(stats, rollups):
+    plan = _plan(stats, TOP_TOTALS, rollups, guild=GUILD)
+    assert any("COVERING INDEX History_guild_state_start" in line for line in plan), plan
+    assert not any(line.startswith("SCAN History") for line in plan), plan
+
+
+@pytest.mark.parametrize("rollups", [False, True])
+def test_user_uses_covering_index(stats, rollups):
+    plan = _plan(stats, USER_TOTALS, rollups, user=1, guild=GUILD)
+    assert any("COVERING INDEX History_user_guild_start" in line for line in plan), plan
+    assert not any(line.startswith("SCAN History") for line in plan), plan
+
+
+def test_top_rollup_matches_raw(sessions):
+    raw = _totals(sessions, TOP_TOTALS, "user", False, guild=GUILD)
+    assert set(raw) == set(USERS)
+    assert _totals(sessions, TOP_TOTALS, "user", True, guild=GUILD) == raw
+
+
+@pytest.mark.parametrize("user", [1, 5])
+def test_user_rollup_matches_raw(sessions, user):
+    raw = _totals(sessions, USER_TOTALS, "voicestate", False, user=user, guild=GUILD)
+    assert set(raw) == set(STATES)
+    assert _totals(sessions, USER_TOTALS, "voicestate", True, user=user, guild=GUILD) == raw
@@ -0,0 +1,43 @@
+"""Voice streaks over local days"""
+
+import datetime
+
+import numpy as np
+
+from whatno.extension.cog_stats import day_runs, local_days
+from whatno.extension.helpers import TimeTravel
+
+
+def _local(*args):
+    return TimeTravel.tz.localize(datetime.datetime(*args)).timestamp()
+
+
+def _day(*args):
+    return (datetime.date(*args) - datetime.date(1970, 1, 1)).days
+
+
+def _days(*sessions):
+    starts = np.array([start for start, _ in sessions], dtype=np.float64)
+    ends = np.array([end for _, end in sessions], dtype=np.float64)
+    return local_days(starts, ends).tolist()
+
+
+def test_evenings_are_consecutive_local_days():
+    # 19:00 and 21:00 eastern are past midnight utc, the second is two utc days on
+    days = _days(
+        (_local(2024, 3, 4, 19), _local(2024, 3, 4, 20)),
+        (_local(2024, 3, 5, 21), _local(2024, 3, 5, 22)),
+    )
+    assert days == [_day(2024, 3, 4), _day(2024, 3, 5)]
+    assert day_runs(np.array(days)) == [(_day(2024, 3, 4), _day(2024, 3, 5), 2)]
+
+
+def test_session_across_midnight_counts_both_days():
+    days = _days((_local(2024, 3, 4, 23), _local(2024, 3, 5, 1)))
+    assert days == [_day(2024, 3, 4), _day(2024, 3, 5)]
+
+
+def test_runs_split_on_gaps():
+    days = np.array([10, 11, 12, 14, 16, 17])
+    assert day_runs(days) == [(10, 12, 3), (14, 14, 1), (16, 17, 2)]
+    assert not day_runs(np.array([], dtype=np.int64))
@@ -1,5 +1,6 @@
 """Import all of the cogs"""
 
+from .cog_dbmaint import setup as dbmaint
 from .cog_doacomic import setup as doacomic
 from .cog_instadown import setup as instadown
 from .cog_rereads import setup as rereads
@@ -10,6 +11,7 @@ from .cog_wnmessage import setup as wnmessage
 from .cog_wntest import setup as wntest
 
 ALL_COGS = [
+    "dbmaint",
     "doacomic",
     "instadown",
     "rereads",
@@ -21,6 +23,7 @@ ALL_COGS = [
 ]
 
 COG_DICT = {
+    "dbmaint": dbmaint,
     "doacomic": doacomic,
     "instadown": instadown,
     "rereads": rereads,
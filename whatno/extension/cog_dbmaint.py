@@ -0,0 +1,232 @@
+"""Database upkeep for the sqlite databases the other cogs register"""
+
+import datetime
+import gzip
+import logging
+from shutil import copyfileobj
+from time import time
+
+import pytz
+from discord.ext.bridge import bridge_group
+from discord.ext.commands import Cog, is_owner
+from discord.ext.tasks import loop
+
+logger = logging.getLogger(__name__)
+
+MAINTAIN_TIME = datetime.time(4, 45, 0, tzinfo=pytz.timezone("US/Eastern"))
+SNAPSHOT_TIME = datetime.time(5, 15, 0, tzinfo=pytz.timezone("US/Eastern"))
+SNAPSHOT_KEEP = 7
+AUTO_VACUUM = {0: "none", 1: "full", 2: "incremental"}
+
+
+def setup(bot):
+    """Add the DB Maintenance Cog to the Bot"""
+    bot.add_cog(DBMaintCog(bot))
+
+
+class DBMaintCog(Cog, name="DB Maintenance"):
+    """Keep the registered databases tuned and compact"""
+
+    def __init__(self, bot):
+        super().__init__()
+        self.bot = bot
+
+        self.snapdir = self.bot.storage / "snapshots"
+        self.snapshot_keep = self.bot.env.int("DB_SNAPSHOT_KEEP", SNAPSHOT_KEEP)
+
+        # function transformed by the @loop annotation
+        # pylint: disable=no-member
+        self.periodic_maintain.start()
+        self.periodic_snapshot.start()
+
+    def cog_unload(self):
+        # function transformed by the @loop annotation
+        # pylint: disable=no-member
+        self.periodic_maintain.cancel()
+        self.periodic_snapshot.cancel()
+
+    def _selected(self, name=None):
+        """Openers of the registered databases, all of them or just `name`"""
+        if name is None:
+            return self.bot.databases
+        if name in self.bot.databases:
+            return {name: self.bot.databases[name]}
+        return {}
+
+    def _maintain(self, name=None):
+        results = {}
+        for dbname, opener in self._selected(name).items():
+            start = time()
+            results[dbname] = opener().maintain()
+            logger.info(
+                "maintained %s database in %s seconds: %s",
+                dbname,
+                time() - start,
+                results[dbname],
+            )
+        return results
+
+    @loop(time=MAINTAIN_TIME)
+    async def periodic_maintain(self):
+        """periodically optimize, checkpoint, and vacuum the databases"""
+        await self.bot.wait_until_ready()
+        await self.bot.blocker(self._maintain)
+        logger.debug(
+            "periodically maintain the databases, next at %s",
+            # function transformed by the @loop annotation
+            # pylint: disable=no-member
+            self.periodic_maintain.next_iteration,
+        )
+
+    def _rotate(self, directory, name):
+        snapshots = sorted(directory.glob(f"{name}-*.db.gz"))
+        expired = snapshots[: max(len(snapshots) - self.snapshot_keep, 0)]
+        for old in expired:
+            logger.debug("removing expired snapshot: %s", old)
+            old.unlink()
+        return len(expired)
+
+    def _snapshot(self, name=None):
+        results = {}
+        for dbname, opener in self._selected(name).items():
+            start = time()
+            directory = self.snapdir / dbname
+            directory.mkdir(parents=True, exist_ok=True)
+            stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+            raw = directory / f"{dbname}-{stamp}.db"
+            final = directory / f"{dbname}-{stamp}.db.gz"
+
+            opener().snapshot(raw)
+            with open(raw, "rb") as src, gzip.open(final, "wb") as dst:
+                copyfileobj(src, dst)
+            raw.unlink()
+
+            removed = self._rotate(directory, dbname)
+            results[dbname] = final
+            logger.info(
+                "snapshot of %s database saved to %s in %s seconds, removed %s old",
+                dbname,
+                final,
+                time() - start,
+                removed,
+            )
+        return results
+
+    @loop(time=SNAPSHOT_TIME)
+    async def periodic_snapshot(self):
+        """periodically take a compressed snapshot of the databases"""
+        await self.bot.wait_until_ready()
+        await self.bot.blocker(self._snapshot)
+        logger.debug(
+            "periodically snapshot the databases, next at %s",
+            # function transformed by the @loop annotation
+            # pylint: disable=no-member
+            self.periodic_snapshot.next_iteration,
+        )
+
+    @staticmethod
+    def _display_size(value):
+        for unit in ("B", "KB", "MB", "GB"):
+            if value < 1024 or unit == "GB":
+                break
+            value /= 1024
+        return f"{value:.1f} {unit}"
+
+    def _display_stats(self, name, info):
+        return (
+            f"{name}: {self._display_size(info['db_size'])} db, "
+            f"{self._display_size(info['wal_size'])} wal ({info['journal_mode']})\n"
+            f"  {info['page_count']} pages of {info['page_size']} B, "
+            f"{info['freelist_count']} free, "
+            f"auto vacuum {AUTO_VACUUM.get(info['auto_vacuum'], info['auto_vacuum'])}\n"
+        )
+
+    @is_owner()
+    @bridge_group()
+    # function name is used as command name
+    # pylint: disable=invalid-name
+    async def db(self, ctx):
+        """database sub commands"""
+        if ctx.invoked_subcommand:
+            return
+        msg = (
+            "```\n"
+            "stats(name): size and page info for the registered databases\n"
+            "maintain(name): optimize, checkpoint, and vacuum the databases now\n"
+            "snapshot(name): take a compressed online backup of the databases now\n"
+            "incremental(name): switch to incremental auto vacuum, a full VACUUM\n"
+            "```"
+        )
+        await ctx.send(msg)
+
+    @is_owner()
+    @db.command()
+    async def stats(self, ctx, name=None):
+        """Size and page info for the databases"""
+        databases = self._selected(name)
+        if not databases:
+            await ctx.send(f"no database registered as {name}")
+            return
+        output = "```\n"
+        for dbname, opener in databases.items():
+            info = await self.bot.blocker(opener().stats)
+            output += self._display_stats(dbname, info)
+        output += "```"
+        await ctx.send(output)
+
+    @is_owner()
+    @db.command()
+    async def maintain(self, ctx, name=None):
+        """Optimize, checkpoint, and vacuum the databases now"""
+        logger.info("manually maintaining databases: %s", name or "all")
+        if not self._selected(name):
+            await ctx.send(f"no database registered as {name}")
+            return
+        async with ctx.typing():
+            await self.bot.blocker(self._maintain, name)
+        await ctx.message.add_reaction("\N{OK HAND SIGN}")
+
+    @is_owner()
+    @db.command()
+    async def snapshot(self, ctx, name=None):
+        """Take a compressed online backup of the databases now"""
+        logger.info("manually snapshotting databases: %s", name or "all")
+        if not self._selected(name):
+            await ctx.send(f"no database registered as {name}")
+            return
+        async with ctx.typing():
+            results = await self.bot.blocker(self._snapshot, name)
+        output = "```\n"
+        for dbname, final in results.items():
+            output += f"{dbname}: {final.name}\n"
+        output += "```"
+        await ctx.send(output)
+
+    def _enable_incremental(self, name):
+        results = {}
+        for dbname, opener in self._selected(name).items():
+            start = time()
+            results[dbname] = opener().enable_incremental()
+            logger.info(
+                "incremental auto vacuum for %s database (%s) in %s seconds",
+                dbname,
+                "switched" if results[dbname] else "already on",
+                time() - start,
+            )
+        return results
+
+    @is_owner()
+    @db.command()
+    async def incremental(self, ctx, name):
+        """Switch a database to incremental auto vacuum with a full VACUUM"""
+        logger.info("manually switching %s to incremental auto vacuum", name)
+        if not self._selected(name):
+            await ctx.send(f"no database registered as {name}")
+            return
+        async with ctx.typing():
+            results = await self.bot.blocker(self._enable_incremental, name)
+        output = "```\n"
+        for dbname, switched in results.items():
+            output += f"{dbname}: {'switched' if switched else 'already incremental'}\n"
+        output += "```"
+        await ctx.send(output)
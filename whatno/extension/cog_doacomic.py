@@ -6,6 +6,7 @@ import re
 from asyncio import create_subprocess_shell, sleep, subprocess
 from collections import namedtuple
 from datetime import datetime, time, timedelta
+from functools import partial
 from json import dump
 from json import load as json_load
 from pathlib import Path
@@ -331,6 +332,7 @@ class DoaComicCog(Cog, name="DoA Comic"):
             dlconfig = self.f_doa / self.bot.env.path("DOWNLOAD")
 
         self.comics = ComicInfo(database, schedule)
+        self.bot.register_database("doa", partial(ComicDB, database, readonly=False))
         self.embeds = ComicEmbeds(embeds)
         self.download = DumbingOfAge(dlconfig, self.f_doa, database)
         # function transformed by the @loop annotation
@@ -17,7 +17,7 @@ from more_itertools import ichunked
 from PIL import Image, ImageDraw, ImageFont
 from tinydb.table import Document
 
-from .helpers import CleanHTML, PrettyStringDB, aget_json, calc_path, strim
+from .helpers import HTMLCleaner, PrettyStringDB, aget_json, calc_path, strim
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +48,8 @@ class SnapData:
 
     AGENT = {"User-Agent": "Snaplook/1.0 Whatno Discord Bot (Sean Slater)"}
 
+    cleaner = HTMLCleaner()
+
     def __init__(self, snapdir, combo, db):
         self.database = db
 
@@ -97,8 +99,9 @@ class SnapData:
             page = await aget_json(session, nxt)
 
         dic = {}
-        for val in res:
-            val["description"] = CleanHTML().process(val["description"])
+        descs = self.cleaner.process_many(val["description"] for val in res)
+        for val, desc in zip(res, descs):
+            val["description"] = desc
             key = val["key"].lower()
             dic[key] = val
         return dic
@@ -107,8 +110,10 @@ class SnapData:
         """Make http requests to get json info on the locations"""
         page = await aget_json(session, self.LOCS_URL)
         dic = {}
-        for loc in page.get("data", []):
-            loc["description"] = CleanHTML().process(loc["description"])
+        locs = page.get("data", [])
+        descs = self.cleaner.process_many(loc["description"] for loc in locs)
+        for loc, desc in zip(locs, descs):
+            loc["description"] = desc
             key = loc["key"].lower()
             dic[key] = loc
         return dic
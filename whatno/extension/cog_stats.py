@@ -2,20 +2,92 @@
 
 import datetime
 import logging
-import re
 from collections import namedtuple
+from io import BytesIO
+from itertools import groupby
 from json import dumps
-from time import localtime, time
+from sqlite3 import OperationalError
+from time import localtime, sleep, time
 
 
+import numpy as np
 import pytz
-from discord import ChannelType, HTTPException, NotFound, Forbidden
+from discord import ChannelType, File, HTTPException, Forbidden, Object
 from discord.ext.bridge import bridge_group
 from discord.ext.commands import Cog, is_owner
 from discord.ext.tasks import loop
 from discord.utils import escape_markdown
-
-from .helpers import ContextDB, TimeTravel, sec_to_human
+from PIL import Image, ImageDraw, ImageFont
+
+from .helpers import (
+    DAY_SECS,
+    HOUR_SECS,
+    TZNAME,
+    ContextDB,
+    LRUCache,
+    MemberDirectory,
+    ResultCache,
+    TimeTravel,
+    WriteQueue,
+    calc_path,
+    sec_to_human,
+)
+from .stats_sql import (
+    ACTIVITY_CLOSE,
+    ACTIVITY_HEARTBEAT,
+    ACTIVITY_INSERT,
+    ACTIVITY_OPEN,
+    ACTIVITY_RECOVER,
+    ACTIVITY_TOTAL,
+    ACTIVITY_TOTALS,
+    COMPRESS_CHUNK_END,
+    COMPRESS_DELETE,
+    COMPRESS_MARK,
+    COMPRESS_START,
+    COPRESENCE_ADD,
+    COPRESENCE_FRIENDS,
+    COPRESENCE_HISTORY,
+    EARLY,
+    HEARTBEAT,
+    HEATMAP_TXT,
+    HEATMAP_VOICE,
+    HISTORY_INSERT,
+    HISTORY_MARK,
+    MESSAGE_AUTHORS,
+    MSG_INSERT,
+    OPEN_DELETE,
+    OPEN_INSERT,
+    OPEN_SPANS,
+    REACT_ADD,
+    REACT_CLEAR,
+    REACT_CLEAR_EMOJI,
+    REACT_EMOJI_TOP,
+    REACT_REMOVE,
+    REACT_USER_TOP,
+    RECOVER_ROLLUPS,
+    RECOVER_SESSIONS,
+    ROLLUP_ADD,
+    ROLLUP_VERSION,
+    SPAN_VERSION,
+    TOP_TOTALS,
+    USER_EARLY,
+    USER_TOTALS,
+    VOICE_RANK,
+    VOICE_SPANS,
+    VOICE_STREAKS,
+    totals_query,
+)
+from .stats_state import (
+    ALL_STATES,
+    MASK_INDEXES,
+    NO_VOICE,
+    STATES,
+    CoPresence,
+    Presence,
+    Reactions,
+    Voice,
+    VoiceCon,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -26,14 +98,6 @@ def setup(bot):
     bot.add_cog(cog_stats)
 
 
-STATES = ["voice", "mute", "deaf", "stream", "video"]
-
-VoiceCon = namedtuple("VoiceCon", ["user", "guild", "channel"])
-VoiceState = namedtuple("VoiceState", ["state", "time"])
-VoiceDiff = namedtuple("VoiceDiff", ["voice", "mute", "deaf", "stream", "video"])
-Voice = namedtuple("Voice", ["voice", "mute", "deaf", "stream", "video"])
-
-MSG_INSERT = "INSERT OR IGNORE INTO Message VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"
 TEXT_CHANNELS = (
     ChannelType.text,
     ChannelType.private,
@@ -44,9 +108,147 @@ TEXT_CHANNELS = (
 )
 
 
+WindowTotals = namedtuple("WindowTotals", ["windows", "totals"])
 ROLLING = (90,)
+FLUSH_SECS = 60
+CACHE_TTL = 60
+RECONCILE_MINS = 15
+MAX_WINDOWS = 5
+MAX_MESSAGE = 2000
 COMPRESS_TIME = datetime.time(9, 30, 0, tzinfo=pytz.timezone('US/Eastern'))
 COMPRESS_WAIT = 7*24*3600*2 # *2 incase previous week was missed
+COMPRESS_CHUNK = 5000
+COMPRESS_PAUSE = 0.05
+OVERLAP_CHUNK = 1_000_000
+PRESENCE_FLUSH_SECS = 30
+REACT_FLUSH_SECS = 10
+MESSAGE_FLUSH_MS = 250
+HISTORY_CHUNK = 500
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+# 1970-01-01 was a thursday
+EPOCH_WEEKDAY = 3
+HEATMAP_CELL = 24
+HEATMAP_LOW = np.array([32, 34, 37])
+HEATMAP_HIGH = np.array([250, 166, 26])
+
+
+def local_seconds(timestamps):
+    """Utc epoch seconds shifted by the local utc offset of their hour"""
+    hours = np.floor_divide(timestamps, HOUR_SECS).astype(np.int64)
+    uniq, inverse = np.unique(hours, return_inverse=True)
+    offsets = np.array([TimeTravel.utcoffset(TimeTravel.tz, hour) for hour in uniq.tolist()])
+    return timestamps + offsets[inverse]
+
+
+def local_days(starts, ends):
+    """Every local day any of the intervals touches, sorted, an interval that
+    crosses midnight counts for each day it spans"""
+    first = np.floor_divide(local_seconds(starts), DAY_SECS).astype(np.int64)
+    last = np.floor_divide(local_seconds(ends), DAY_SECS).astype(np.int64)
+    counts = np.maximum(last - first + 1, 1)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.unique(np.repeat(first, counts) + offsets)
+
+
+def day_runs(days):
+    """(first, last, length) of each run of consecutive days in sorted days"""
+    if days.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(days) != 1) + 1
+    firsts = np.concatenate(([0], breaks))
+    lasts = np.concatenate((breaks, [len(days)])) - 1
+    return [
+        (int(days[first]), int(days[last]), int(last - first + 1))
+        for first, last in zip(firsts, lasts)
+    ]
+
+
+def _week_hours(hours):
+    """Index into a flattened weekday x hour grid for local epoch hours"""
+    return (hours // 24 + EPOCH_WEEKDAY) % 7 * 24 + hours % 24
+
+
+def bin_intervals(starts, ends):
+    """Seconds of the intervals in each local weekday x hour, an interval is
+    split across every hour it spans"""
+    local = local_seconds(starts)
+    ends = ends + (local - starts)
+    starts = local
+    first = np.floor_divide(starts, HOUR_SECS).astype(np.int64)
+    last = np.ceil(ends / HOUR_SECS).astype(np.int64) - 1
+    counts = np.where(ends > starts, last - first + 1, 0)
+    idxs = np.repeat(np.arange(len(starts)), counts)
+    hours = first[idxs] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    seconds = np.minimum(ends[idxs], (hours + 1) * HOUR_SECS) - np.maximum(
+        starts[idxs], hours * HOUR_SECS
+    )
+    return np.bincount(_week_hours(hours), weights=seconds, minlength=7 * 24).reshape(7, 24)
+
+
+def bin_timestamps(timestamps):
+    """Count of the timestamps in each local weekday x hour"""
+    hours = np.floor_divide(local_seconds(timestamps), HOUR_SECS).astype(np.int64)
+    return np.bincount(_week_hours(hours), minlength=7 * 24).reshape(7, 24).astype(np.float64)
+
+
+def render_heatmap(grid, title):
+    """Png of the weekday x hour grid, brighter for more activity"""
+    scale = grid / grid.max() if grid.max() > 0 else grid
+    colors = HEATMAP_LOW + (HEATMAP_HIGH - HEATMAP_LOW) * scale[..., None]
+    cells = Image.fromarray(colors.astype(np.uint8), "RGB").resize(
+        (24 * HEATMAP_CELL, 7 * HEATMAP_CELL), Image.NEAREST
+    )
+
+    font = ImageFont.truetype(str(calc_path("ubuntu.ttf")), 14)
+    left, top = 48, 52
+    img = Image.new("RGB", (left + cells.width + 10, top + cells.height + 10), (0, 0, 0))
+    img.paste(cells, (left, top))
+    draw = ImageDraw.Draw(img)
+    draw.text((left, 8), title, font=font, fill=(255, 255, 255))
+    for hour in range(0, 24, 3):
+        spot = (left + hour * HEATMAP_CELL + 2, top - 20)
+        draw.text(spot, f"{hour:02}", font=font, fill=(200, 200, 200))
+    for day, name in enumerate(WEEKDAYS):
+        draw.text((8, top + day * HEATMAP_CELL + 4), name, font=font, fill=(200, 200, 200))
+
+    buffer = BytesIO()
+    img.save(buffer, "png")
+    return buffer.getvalue()
+
+
+def overlap_pairs(users, starts, ends, max_pairs=OVERLAP_CHUNK):
+    """Seconds each pair of users overlapped across one channel's intervals
+
+    Sorted by start, every interval overlaps the ones after it that start
+    before it ends, those pairs are expanded with numpy in chunks of about
+    `max_pairs` and summed per pair. Yields (user, other, seconds) with
+    user < other, a pair can show up once per chunk.
+    """
+    order = np.argsort(starts, kind="stable")
+    users, starts, ends = users[order], starts[order], ends[order]
+    idxs = np.arange(len(starts))
+    counts = np.maximum(np.searchsorted(starts, ends, side="left") - idxs - 1, 0)
+    totals = np.cumsum(counts)
+    codes, dense = np.unique(users, return_inverse=True)
+    size = len(codes)
+
+    low = 0
+    while low < len(starts):
+        limit = totals[low] - counts[low] + max_pairs
+        high = max(int(np.searchsorted(totals, limit, side="right")), low + 1)
+        chunk = counts[low:high]
+        first = np.repeat(idxs[low:high], chunk)
+        offset = np.arange(chunk.sum()) - np.repeat(np.cumsum(chunk) - chunk, chunk)
+        second = first + 1 + offset
+        seconds = np.minimum(ends[first], ends[second]) - starts[second]
+        keep = (dense[first] != dense[second]) & (seconds > 0)
+        one, two = dense[first][keep], dense[second][keep]
+        keys = np.minimum(one, two).astype(np.int64) * size + np.maximum(one, two)
+        pairs, inverse = np.unique(keys, return_inverse=True)
+        sums = np.bincount(inverse, weights=seconds[keep])
+        for pair, total in zip(pairs.tolist(), sums.tolist()):
+            yield int(codes[pair // size]), int(codes[pair % size]), total
+        low = high
 
 
 class Message:
@@ -120,21 +322,90 @@ class StatsCog(Cog):
         self.database_file = self.statdir / self.bot.env.path("STATS_DATABASE")
         # self.database_file = self.bot.env.path("STATS_DATABASE")
         self._database().setup()
+        self.bot.register_database("stats", self._database)
+        self._recover_sessions()
+        self._recover_activities()
 
         self.current = {}
+        self.ledger = {}
+        self.members = MemberDirectory()
+        self.copresence = CoPresence()
+        self.backfilling = False
+        self.results = ResultCache()
+        # sessions changed by voice events since the last flush
+        self.dirty_opened = {}
+        self.dirty_closed = []
+        self.presence = Presence()
+        self.reactions = Reactions()
+        # names of the flushes with a write in the executor
+        self.flushing = set()
+        # message id -> author id, so edits and deletes rarely need a lookup
+        self.authors = LRUCache(self.bot.env.int("STATS_MESSAGE_AUTHORS", LRUCache.MAX_SIZE))
+        self.messages = WriteQueue(
+            self._write_messages,
+            batch=self.bot.env.int("STATS_MESSAGE_BATCH", WriteQueue.BATCH),
+            delay=self.bot.env.int("STATS_MESSAGE_FLUSH_MS", MESSAGE_FLUSH_MS) / 1000,
+            max_rows=self.bot.env.int("STATS_MESSAGE_QUEUE", WriteQueue.MAX_ROWS),
+        )
+        self.migrated = set()
+        self.migrating = False
+
+        flush_secs = self.bot.env.int("STATS_FLUSH_SECS", FLUSH_SECS)
+        reconcile_mins = self.bot.env.int("STATS_RECONCILE_MINS", RECONCILE_MINS)
         # function transformed by the @loop annotation
         # pylint: disable=no-member
+        self.periodic_flush.change_interval(seconds=flush_secs)
+        self.periodic_save.change_interval(minutes=reconcile_mins)
+        self.periodic_flush.start()
         self.periodic_save.start()
+        self.periodic_presence.start()
+        self.periodic_reactions.start()
+        self.message_writer.start()
         self.periodic_compress.start()
 
     def _database(self, readonly=False):
         return StatDB(self.database_file, readonly)
 
+    async def _flush(self, name, take, write, restore):
+        """Write the batch from `take` with `write` in the executor
+
+        Only one flush of each name runs at a time. `take` returns the
+        arguments for `write` and `restore`, or None if there's nothing to
+        write. A batch that fails with OperationalError goes back through
+        `restore` to be retried. Returns the batch once it's written.
+        """
+        if name in self.flushing:
+            return None
+        batch = take()
+        if batch is None:
+            return None
+        self.flushing.add(name)
+        try:
+            await self.bot.blocker(write, *batch)
+        except OperationalError as err:
+            restore(*batch)
+            logger.warning("failed writing %s, will retry: %s", name, err)
+            return None
+        finally:
+            self.flushing.discard(name)
+        return batch
+
     def cog_unload(self):
-        self._save_current()
         # function transformed by the @loop annotation
         # pylint: disable=no-member
+        self.message_writer.cancel()
+        self.messages.flush()
+        for take, write in (
+            (self._take_dirty, self._write_sessions),
+            (self._take_presence, self._write_presence),
+            (self._take_reactions, self._write_reactions),
+        ):
+            if (batch := take()) is not None:
+                write(*batch)
+        self.periodic_flush.cancel()
         self.periodic_save.cancel()
+        self.periodic_presence.cancel()
+        self.periodic_reactions.cancel()
         self.periodic_compress.cancel()
 
     #########################
@@ -144,47 +415,143 @@ class StatsCog(Cog):
     @Cog.listener("on_ready")
     async def load_current(self):
         """Load current voice users into memory"""
-        self._save_current()
+        await self._save_current()
+
+    #########################
+    ###     Activities    ###
+    #########################
 
     @staticmethod
-    def _start_state(state, timestamp):
-        return Voice(
-            voice=VoiceState("voice", timestamp),
-            mute=VoiceState("mute", timestamp) if state.self_mute else None,
-            deaf=VoiceState("deaf", timestamp) if state.self_deaf else None,
-            stream=VoiceState("stream", timestamp) if state.self_stream else None,
-            video=VoiceState("video", timestamp) if state.self_video else None,
+    def _activities(member):
+        return frozenset(
+            (activity.type.name, activity.name)
+            for activity in member.activities
+            if activity.name and activity.type.name != "custom"
+        )
+
+    def _recover_activities(self):
+        """Close any activities left open by a restart or crash at the last heartbeat"""
+        with self._database() as db:
+            rows = db.execute(ACTIVITY_RECOVER).fetchall()
+            closed = [
+                (row["user"], row["kind"], row["name"], row["starttime"], row["duration"])
+                for row in rows
+            ]
+            db.executemany(ACTIVITY_INSERT, closed)
+            db.executemany(ACTIVITY_TOTAL, [(*closing[:3], closing[4]) for closing in closed])
+            db.execute("DELETE FROM OpenActivity")
+        if closed:
+            logger.info("recovered %s activities left open", len(closed))
+
+    def _write_presence(self, opened, closed):
+        """Close and open activity sessions in a single transaction"""
+        with self._database() as db:
+            if closed:
+                db.executemany(ACTIVITY_INSERT, closed)
+                db.executemany(ACTIVITY_TOTAL, [(*closing[:3], closing[4]) for closing in closed])
+                db.executemany(ACTIVITY_CLOSE, [closing[:3] for closing in closed])
+            if opened:
+                db.executemany(ACTIVITY_OPEN, opened)
+            db.execute(ACTIVITY_HEARTBEAT, (TimeTravel.timestamp(),))
+
+    def _take_presence(self):
+        """Activity sessions opened and closed since the last flush, None if
+        there's nothing to write, not even the heartbeat"""
+        opened, closed = self.presence.changes()
+        if not (opened or closed or self.presence.open):
+            return None
+        return opened, closed
+
+    async def _flush_presence(self):
+        """Write the activity sessions opened and closed since the last flush"""
+        batch = await self._flush(
+            "activity sessions", self._take_presence, self._write_presence, self.presence.restore
         )
+        if batch is None:
+            return 0
+        opened, closed = batch
+        return len(opened) + len(closed)
+
+    @Cog.listener("on_presence_update")
+    async def presence_change(self, _, after):
+        """Coalesce activity changes, flushing early if too many are pending"""
+        if after.bot:
+            return
+        if self.presence.update(after.id, self._activities(after), TimeTravel.timestamp()):
+            await self._flush_presence()
+
+    @Cog.listener("on_ready")
+    async def load_presence(self):
+        """Start tracking the activities members already have"""
+        now = TimeTravel.timestamp()
+        for guild in self.bot.guilds:
+            for member in guild.members:
+                if member.bot:
+                    continue
+                if self.presence.update(member.id, self._activities(member), now):
+                    await self._flush_presence()
+        await self._flush_presence()
+
+    @loop(seconds=PRESENCE_FLUSH_SECS)
+    async def periodic_presence(self):
+        """periodically write the activity changes"""
+        await self.bot.wait_until_ready()
+        if flushed := await self._flush_presence():
+            logger.debug(
+                "flushed %s activity sessions, next at %s",
+                flushed,
+                # function transformed by the @loop annotation
+                # pylint: disable=no-member
+                self.periodic_presence.next_iteration,
+            )
+
+    #########################
+    ### Member Directory  ###
+    #########################
+
+    def _load_guild(self, guild):
+        self.members.load(guild.id, ((m.id, m.nick, m.name) for m in guild.members))
+
+    @Cog.listener("on_ready")
+    async def load_members(self):
+        """Index the members of every guild"""
+        for guild in self.bot.guilds:
+            self._load_guild(guild)
+
+    @Cog.listener("on_guild_join")
+    async def member_guild_join(self, guild):
+        """Index the members of a new guild"""
+        self._load_guild(guild)
+
+    @Cog.listener("on_guild_remove")
+    async def member_guild_remove(self, guild):
+        """Forget a guild the bot left"""
+        self.members.drop(guild.id)
+
+    @Cog.listener("on_member_join")
+    async def member_join(self, member):
+        """Add a new member to the directory"""
+        self.members.add(member.guild.id, member.id, member.nick, member.name)
+
+    @Cog.listener("on_member_update")
+    async def member_update(self, _, after):
+        """Keep nick changes current"""
+        self.members.add(after.guild.id, after.id, after.nick, after.name)
+
+    @Cog.listener("on_member_remove")
+    async def member_remove(self, member):
+        """Remove a member that left"""
+        self.members.remove(member.guild.id, member.id)
+
+    @Cog.listener("on_user_update")
+    async def member_rename(self, before, after):
+        """Keep name changes current in every guild"""
+        if before.name != after.name:
+            self.members.rename(after.id, after.name)
 
     @staticmethod
-    def _diff_state(first, second, now):
-        voicediff = second.voice.time - first.voice.time
-
-        mutediff = None
-        if second.mute is not None and first.mute is not None:
-            mutediff = second.mute.time - first.mute.time
-        elif second.mute is None and first.mute is not None:
-            mutediff = now - first.mute.time
-
-        deafdiff = None
-        if second.deaf is not None and first.deaf is not None:
-            deafdiff = second.deaf.time - first.deaf.time
-        elif second.deaf is None and first.deaf is not None:
-            deafdiff = now - first.deaf.time
-
-        streamdiff = None
-        if second.stream is not None and first.stream is not None:
-            streamdiff = second.stream.time - first.stream.time
-        elif second.stream is None and first.stream is not None:
-            streamdiff = now - first.stream.time
-
-        videodiff = None
-        if second.video is not None and first.video is not None:
-            videodiff = second.video.time - first.video.time
-        elif second.video is None and first.video is not None:
-            videodiff = now - first.video.time
-
-        return VoiceDiff(voicediff, mutediff, deafdiff, streamdiff, videodiff)
+    def _start_state(state, timestamp):
+        return Voice.start(state, timestamp)
 
     def current_voice(self):
         """setup current users in voice"""
@@ -224,127 +591,241 @@ class StatsCog(Cog):
             after_info,
         )
 
-    def _check_entry(self, uid, cid, state, tss):
+    @staticmethod
+    def _transition(id_, before, after, now, leaving=False):
+        """Sessions opened and closed going from `before` to `after`
+
+        opened are (ledger key, start) for states that are active in after but
+        weren't before, closed are (ledger key, start, duration) for states that
+        have ended, every state closes when `leaving` the channel
+        """
+        staying = ALL_STATES * (not leaving)
+        after_mask = after.mask & staying
+        bstarts = before.starts
+        astarts = after.starts
+        closed = [
+            ((id_, STATES[idx]), bstarts[idx], now - bstarts[idx])
+            for idx in MASK_INDEXES[before.mask & ~after_mask]
+        ]
+        opened = [
+            ((id_, STATES[idx]), astarts[idx])
+            for idx in MASK_INDEXES[after_mask & ~before.mask]
+        ]
+        return opened, closed
+
+    @staticmethod
+    def _copresence_rows(together):
+        rows = []
+        for (guild, user, other), seconds in together.items():
+            rows.append((guild, user, other, seconds))
+            rows.append((guild, other, user, seconds))
+        return rows
+
+    def _write_sessions(self, opened, closed, now, together=None):
+        """Close and open sessions in a single transaction
+
+        Closed sessions are written to History once with their final duration
+        and removed from OpenSession. Opened sessions are added to OpenSession
+        and their rowid kept in the ledger once committed. The heartbeat is
+        bumped so open sessions can be closed at the right time after a crash.
+        """
+        rowids = {}
+        with self._database() as db:
+            if closed:
+                logger.debug("closing sessions: %s", closed)
+                tscs = TimeTravel.sqlts_many(start for _, start, _ in closed)
+                db.executemany(
+                    HISTORY_INSERT,
+                    [
+                        (id_.user, id_.guild, id_.channel, state, start, duration, False, tsc)
+                        for ((id_, state), start, duration), tsc in zip(closed, tscs)
+                    ],
+                )
+                deletes = []
+                for key, start, _ in closed:
+                    id_, state = key
+                    deletes.append((self.ledger.get(key), id_.user, id_.channel, state, start))
+                db.executemany(OPEN_DELETE, deletes)
+                db.executemany(
+                    ROLLUP_ADD,
+                    [
+                        (start, id_.user, id_.guild, state, duration)
+                        for (id_, state), start, duration in closed
+                    ],
+                )
+                db.execute(EARLY, (min(start for _, start, _ in closed),))
+            if opened:
+                logger.debug("opening sessions: %s", opened)
+                tscs = TimeTravel.sqlts_many(start for _, start in opened)
+                for ((id_, state), start), tsc in zip(opened, tscs):
+                    values = (id_.user, id_.guild, id_.channel, state, start, tsc)
+                    rowids[(id_, state)] = db.execute(OPEN_INSERT, values).fetchone()["rowid"]
+            if together:
+                db.executemany(COPRESENCE_ADD, self._copresence_rows(together))
+            db.execute(HEARTBEAT, (now,))
+        # a rolled back insert's rowid can be handed out again
+        for key, _, _ in closed:
+            self.ledger.pop(key, None)
+        self.ledger.update(rowids)
+
+    def _mark_dirty(self, opened, closed):
+        """Queue sessions to be written on the next flush
+
+        A session that closes before its open was flushed never reaches
+        OpenSession, it's only written to History when closed.
+        """
+        for key, start, duration in closed:
+            if self.dirty_opened.get(key) == start:
+                del self.dirty_opened[key]
+            self.dirty_closed.append((key, start, duration))
+            id_, state = key
+            if state == "voice":
+                self.copresence.leave(id_.guild, id_.channel, id_.user, start + duration)
+        for key, start in opened:
+            self.dirty_opened[key] = start
+            id_, state = key
+            if state == "voice":
+                self.copresence.join(id_.guild, id_.channel, id_.user, start)
+
+    def _take_dirty(self):
+        """Hand over the queued sessions and the co-presence up to now, None if
+        there's nothing to write, not even the heartbeat"""
+        now = TimeTravel.timestamp()
+        opened = list(self.dirty_opened.items())
+        closed = self.dirty_closed
+        self.dirty_opened = {}
+        self.dirty_closed = []
+        together = self.copresence.drain(now)
+        if not (opened or closed or together or self.current):
+            return None
+        return opened, closed, now, together
+
+    def _restore_dirty(self, opened, closed, _, together):
+        """Queue a batch that failed to write again, ahead of anything newer
+
+        An open that was closed in the meantime is dropped, its close is queued
+        and writes the whole session to History.
+        """
+        closing = {(key, start) for key, start, _ in self.dirty_closed}
+        for key, start in opened:
+            if (key, start) not in closing:
+                self.dirty_opened.setdefault(key, start)
+        self.dirty_closed[:0] = closed
+        self.copresence.restore(together)
+
+    async def _flush_dirty(self):
+        """Write the queued sessions, or just the heartbeat if nothing changed"""
+        batch = await self._flush(
+            "voice sessions", self._take_dirty, self._write_sessions, self._restore_dirty
+        )
+        if batch is None:
+            return 0
+        opened, closed, _, _ = batch
+        # the heartbeat moves the duration of every open session too
+        self.results.bump(
+            *{id_.guild for id_ in self.current},
+            *{id_.guild for (id_, _), *_ in closed},
+            *{id_.guild for (id_, _), _ in opened},
+        )
+        return len(opened) + len(closed)
+
+    def _backfill_copresence(self):
+        """Add the overlaps from before tracking started, one channel per transaction"""
         with self._database(readonly=True) as db:
-            states = db.execute(
+            progress = db.execute("SELECT * FROM Backfill WHERE name = 'copresence'").fetchone()
+            cut = db.execute("SELECT ts FROM Timestamps WHERE name = 'copresence'").fetchone()["ts"]
+        if progress is not None and progress["finished"] is not None:
+            return 0
+        cursor = -1 if progress is None else progress["cursor"]
+        logger.info("backfilling voice co-presence after channel %s", cursor)
+
+        start = time()
+        channels = 0
+        with self._database(readonly=True) as reader:
+            rows = reader.execute(COPRESENCE_HISTORY, {"cut": cut, "cursor": cursor})
+            chunks = iter(lambda: rows.fetchmany(COMPRESS_CHUNK), [])
+            streamed = (row for chunk in chunks for row in chunk)
+            for _, group in groupby(streamed, key=lambda row: row["channel"]):
+                self._backfill_channel(list(group))
+                channels += 1
+
+        with self._database() as db:
+            db.execute(
                 """
-                SELECT *
-                FROM History
-                WHERE user = ?
-                  AND channel = ?
-                  AND voicestate = ?
-                  AND h_time = ?
+                INSERT INTO Backfill VALUES ('copresence', NULL, ?)
+                ON CONFLICT(name) DO UPDATE SET finished = excluded.finished
                 """,
-                (uid, cid, state, tss),
-            ).fetchone()
-        return bool(states)
-
-    # pylint: disable=too-many-branches
-    def _update_state(self, id_, before, after, now):
-        diff = self._diff_state(before, after, now)
-
-        uid = id_.user
-        gid = id_.guild
-        cid = id_.channel
-
-        updates = []
-        inserts = []
-        if diff.voice is not None:
-            bts = before.voice.time
-            tsc = TimeTravel.sqlts(bts)
-            if self._check_entry(uid, cid, "voice", tsc):
-                updates.append((diff.voice, uid, cid, "voice", tsc))
-            else:
-                inserts.append((uid, gid, cid, "voice", bts, diff.voice, False, tsc))
-
-        if diff.mute is not None:
-            bts = before.mute.time
-            tsc = TimeTravel.sqlts(bts)
-            if self._check_entry(uid, cid, "mute", tsc):
-                updates.append((diff.mute, uid, cid, "mute", tsc))
-            else:
-                inserts.append((uid, gid, cid, "mute", bts, diff.mute, False, tsc))
+                (time(),),
+            )
+        self.results.clear()
+        logger.info(
+            "backfilled voice co-presence of %s channels in %s seconds", channels, time() - start
+        )
+        return channels
+
+    def _backfill_channel(self, rows):
+        guild, channel = rows[0]["guild"], rows[0]["channel"]
+        users = np.array([row["user"] for row in rows], dtype=np.int64)
+        starts = np.array([row["starttime"] for row in rows], dtype=np.float64)
+        ends = np.array([row["endtime"] for row in rows], dtype=np.float64)
+        together = {}
+        for user, other, seconds in overlap_pairs(users, starts, ends):
+            together[(guild, user, other)] = together.get((guild, user, other), 0) + seconds
+        with self._database() as db:
+            db.executemany(COPRESENCE_ADD, self._copresence_rows(together))
+            db.execute(
+                """
+                INSERT INTO Backfill VALUES ('copresence', ?1, NULL)
+                ON CONFLICT(name) DO UPDATE SET cursor = ?1
+                """,
+                (channel,),
+            )
 
-        if diff.deaf is not None:
-            bts = before.deaf.time
-            tsc = TimeTravel.sqlts(bts)
-            if self._check_entry(uid, cid, "deaf", tsc):
-                updates.append((diff.deaf, uid, cid, "deaf", tsc))
-            else:
-                inserts.append((uid, gid, cid, "deaf", bts, diff.deaf, False, tsc))
+    @Cog.listener("on_ready")
+    async def backfill_copresence(self):
+        """Fill in the co-presence from before it was tracked"""
+        if self.backfilling:
+            return
+        self.backfilling = True
+        try:
+            await self.bot.blocker(self._backfill_copresence)
+        finally:
+            self.backfilling = False
 
-        if diff.stream is not None:
-            bts = before.stream.time
-            tsc = TimeTravel.sqlts(bts)
-            if self._check_entry(uid, cid, "stream", tsc):
-                updates.append((diff.stream, uid, cid, "stream", tsc))
-            else:
-                inserts.append((uid, gid, cid, "stream", bts, diff.stream, False, tsc))
-
-        if diff.video is not None:
-            bts = before.video.time
-            tsc = TimeTravel.sqlts(bts)
-            if self._check_entry(uid, cid, "video", tsc):
-                updates.append((diff.video, uid, cid, "video", tsc))
-            elif diff.video is not None:
-                inserts.append((uid, gid, cid, "video", bts, diff.video, False, tsc))
-
-        if updates:
-            logger.debug("db updates: %s", updates)
-            with self._database() as db:
-                db.executemany(
-                    """
-                    UPDATE History
-                    SET duration = ?
-                    WHERE user = ?
-                    AND channel = ?
-                    AND voicestate = ?
-                    AND h_time = ?
-                    """,
-                    updates,
-                )
+    def _migrate_deferred(self):
+        if applied := self._database().migrate(deferred=True):
+            logger.info("applied deferred migrations to the stats database: %s", applied)
 
-        if inserts:
-            logger.debug("db inserts: %s", inserts)
-            with self._database() as db:
-                db.executemany("INSERT INTO History VALUES (?,?,?,?,?,?,?,?)", inserts)
+    @Cog.listener("on_ready")
+    async def deferred_migrations(self):
+        """Apply the long running migrations in the background once connected"""
+        if self.migrating:
+            return
+        self.migrating = True
+        try:
+            await self.bot.blocker(self._migrate_deferred)
+        finally:
+            self.migrating = False
 
-    @staticmethod
-    def _new_state(status, before, after):
-        bstate = getattr(before, status)
-        astate = getattr(after, status)
-        nstate = bstate
-        if bstate is None and astate is not None:
-            nstate = astate
-        elif bstate is not None and astate is None:
-            nstate = None
-        return nstate
-
-    def _save_state_change(self, id_, before, after, now):
-        self._update_state(id_, before, after, now)
-
-        voice = self._new_state("voice", before, after)
-        mute = self._new_state("mute", before, after)
-        deaf = self._new_state("deaf", before, after)
-        stream = self._new_state("stream", before, after)
-        video = self._new_state("video", before, after)
-
-        return Voice(voice=voice, mute=mute, deaf=deaf, stream=stream, video=video)
-
-    def _get_new_state(self, id_, state, now):
-        logger.info("%s: %s", id_, self.current)
-        prev_state = self.current[id_]
-        new_state = self._start_state(state, now)
-        return self._save_state_change(id_, prev_state, new_state, now)
+    def _recover_sessions(self):
+        """Close any sessions left open by a restart or crash at the last heartbeat"""
+        with self._database() as db:
+            db.execute(RECOVER_ROLLUPS)
+            db.execute(RECOVER_SESSIONS)
+            recovered = db.rowcount
+            db.execute("DELETE FROM OpenSession")
+        if recovered:
+            logger.info("recovered %s voice sessions left open", recovered)
 
     @staticmethod
-    def _set_timestamp(current, new_ts):
-        voice = VoiceState("voice", new_ts) if current.voice else None
-        mute = VoiceState("mute", new_ts) if current.mute else None
-        deaf = VoiceState("deaf", new_ts) if current.deaf else None
-        stream = VoiceState("stream", new_ts) if current.stream else None
-        video = VoiceState("video", new_ts) if current.video else None
-        return Voice(voice=voice, mute=mute, deaf=deaf, stream=stream, video=video)
+    def _merge_state(before, after):
+        """The states of `after`, keeping the start times of the ones that were
+        already active in `before`, reuses the freshly started `after`"""
+        bstarts = before.starts
+        astarts = after.starts
+        for idx in MASK_INDEXES[before.mask & after.mask]:
+            astarts[idx] = bstarts[idx]
+        return after
 
     @Cog.listener("on_voice_state_update")
     async def voice_change(self, member, before, after):
@@ -365,44 +846,73 @@ class StatsCog(Cog):
             b_id = VoiceCon(member.id, guild, before.channel.id)
             a_id = VoiceCon(member.id, guild, after.channel.id)
             # "leave" previous channel
-            updated = self._get_new_state(b_id, after, now)
-            del self.current[b_id]
+            prev = self.current.pop(b_id, NO_VOICE)
+            _, closed = self._transition(b_id, prev, NO_VOICE, now, leaving=True)
             # "join" new channel
-            self.current[a_id] = self._set_timestamp(updated, now)
+            self.current[a_id] = self._start_state(after, now)
+            opened, _ = self._transition(a_id, NO_VOICE, self.current[a_id], now)
+            self._mark_dirty(opened, closed)
             return
 
         channel = before.channel.id if not join else after.channel.id
         id_ = VoiceCon(member.id, guild, channel)
-
-        if join:
-            self.current[id_] = self._start_state(after, now)
-            return
-
-        updated = self._get_new_state(id_, after, now)
+        prev = self.current.get(id_, NO_VOICE)
+        new = self._start_state(after, now)
+        opened, closed = self._transition(id_, prev, new, now, leaving=leave)
 
         if leave:
-            del self.current[id_]
+            self.current.pop(id_, None)
         else:
-            self.current[id_] = updated
+            self.current[id_] = self._merge_state(prev, new)
+
+        self._mark_dirty(opened, closed)
 
-    def _save_current(self):
+    async def _save_current(self):
+        """Reconcile the tracked sessions against every voice channel and flush
+
+        Catches anything the voice events missed, users already in voice when
+        the bot connects and users who left while it was disconnected.
+        """
         now = TimeTravel.timestamp()
         current = self.current_voice()
+        guilds = {guild.id for guild in self.bot.guilds}
+        seen = set()
+        opened = []
+        closed = []
         for id_, data in current:
-            if id_ in self.current:
-                prev = self.current[id_]
-                self._update_state(id_, prev, data, now)
-            else:
-                self.current[id_] = data
+            seen.add(id_)
+            prev = self.current.get(id_, NO_VOICE)
+            new_opened, new_closed = self._transition(id_, prev, data, now)
+            opened.extend(new_opened)
+            closed.extend(new_closed)
+            self.current[id_] = self._merge_state(prev, data)
+        for id_ in [id_ for id_ in self.current if id_ not in seen and id_.guild in guilds]:
+            _, gone = self._transition(id_, self.current.pop(id_), NO_VOICE, now, leaving=True)
+            closed.extend(gone)
+        self._mark_dirty(opened, closed)
+        await self._flush_dirty()
         return bool(current)
 
-    @loop(seconds=60)
+    @loop(seconds=FLUSH_SECS)
+    async def periodic_flush(self):
+        """periodically write the voice sessions changed since the last flush"""
+        await self.bot.wait_until_ready()
+        if flushed := await self._flush_dirty():
+            logger.debug(
+                "flushed %s voice sessions, next at %s",
+                flushed,
+                # function transformed by the @loop annotation
+                # pylint: disable=no-member
+                self.periodic_flush.next_iteration,
+            )
+
+    @loop(minutes=RECONCILE_MINS)
     async def periodic_save(self):
-        """periodically save the voice stats"""
+        """periodically reconcile the voice stats with every voice channel"""
         await self.bot.wait_until_ready()
-        if self._save_current():
+        if await self._save_current():
             logger.debug(
-                "periodically save the voice stats, next at %s",
+                "periodically reconcile the voice stats, next at %s",
                 # function transformed by the @loop annotation
                 # pylint: disable=no-member
                 self.periodic_save.next_iteration,
@@ -428,6 +938,33 @@ class StatsCog(Cog):
             val += f"{s} sec{'s' if s != 1 else ''}"
         return val
 
+    @staticmethod
+    def _display_short(value):
+        d, h, m, s = sec_to_human(value)
+        parts = [f"{num}{unit}" for num, unit in ((d, "d"), (h, "h"), (m, "m")) if num]
+        return " ".join(parts) or f"{s}s"
+
+    @staticmethod
+    def _window_name(days, early=None):
+        if days is not None:
+            return f"{days} days"
+        if early:
+            return f"since {TimeTravel.pretty_ts(early).split(' ')[0]}"
+        return "all time"
+
+    def _window_table(self, rows, windows, early):
+        """Side by side columns of totals, one per window, for each labeled row"""
+        header = [""] + [self._window_name(days, early) for days in windows]
+        table = [header] + [
+            [label] + [self._display_short(value) for value in values]
+            for label, values in rows
+        ]
+        widths = [max(len(line[col]) for line in table) for col in range(len(header))]
+        return "".join(
+            "  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() + "\n"
+            for line in table
+        )
+
     # pylint: disable=too-many-arguments
     async def _generate_voice_output(
         self,
@@ -438,54 +975,91 @@ class StatsCog(Cog):
         user,
         guild,
     ):
-        member = await guild.fetch_member(user)
-        e_time = f" - past {ROLLING[0]} days"
+        name = self._member_names(guild, [user])[user]
+        windows = results.windows
+        if len(windows) > 1:
+            output = f"```\n{name}\n"
+            rows = []
+            for state, values in results.totals.items():
+                green = " 🟢" if in_voice and (state == "voice" or stats.active(state)) else ""
+                rows.append((f"{state}{green}", values))
+            output += self._window_table(rows, windows, early)
+            output += "```"
+            return output
+
+        e_time = f" - past {windows[0]} days"
         if early:
             e_time = f" - since {TimeTravel.pretty_ts(early)}"
-        output = f"```\n{member.nick or member.name}{e_time}\n"
-        for state, value in results.items():
+        output = f"```\n{name}{e_time}\n"
+        for state, (value,) in results.totals.items():
             val = self._display_duration(value)
-            green = " 🟢" if in_voice and (getattr(stats, state, False) or state == "voice") else ""
+            green = " 🟢" if in_voice and (state == "voice" or stats.active(state)) else ""
             output += f"{state}{green}: {val}\n"
         output += "```"
         return output
 
-    async def _user_stat(self, user, guild, alltime=False):
-        rows = None
-        logger.debug("get all time stats: %s", alltime)
-        since = TimeTravel.tsinpast(*ROLLING)
-        with self._database(readonly=True) as db:
-            if alltime:
-                rows = db.execute(
-                    """
-                    SELECT voicestate, sum(duration) as total, min(starttime) as early
-                    FROM History
-                    WHERE user = ? and guild = ?
-                    GROUP BY voicestate
-                    """,
-                    (user, guild.id),
-                ).fetchall()
+    def _migrated(self, db, version):
+        """If a deferred migration has been applied, remembered once it has"""
+        if version not in self.migrated and db.execute(
+            "SELECT 1 FROM schema_version WHERE version = ?",
+            (version,),
+        ).fetchone():
+            self.migrated.add(version)
+        return version in self.migrated
+
+    def _rollups_ready(self, db):
+        return self._migrated(db, ROLLUP_VERSION)
+
+    def _voice_totals(self, db, query, windows, **params):
+        sql, params = totals_query(query, windows, self._rollups_ready(db), **params)
+        return db.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _parse_windows(args):
+        """Windows from command args like `7 30d all`, None if any arg isn't one"""
+        windows = []
+        for arg in args:
+            arg = arg.lower().rstrip("d")
+            if arg == "all":
+                days = None
+            elif arg.isdigit() and int(arg) > 0:
+                days = int(arg)
             else:
-                rows = db.execute(
-                    """
-                    SELECT voicestate, sum(duration) as total
-                    FROM History
-                    WHERE user = ? and guild = ? and starttime > ?
-                    GROUP BY voicestate
-                    """,
-                    (user, guild.id, since),
-                ).fetchall()
-        results = {}
+                return None
+            if days not in windows:
+                windows.append(days)
+        return tuple(windows[:MAX_WINDOWS])
+
+    def _cached(self, key, query):
+        """Result of `query` from the cache or run and cached, sliding windows
+        only live for the ttl since they change as time passes"""
+        result = self.results.get(key)
+        if result is None:
+            generation = self.results.generation(key[1])
+            result = query()
+            ttl = None if key[3] == (None,) else CACHE_TTL
+            self.results.put(key, result, ttl=ttl, generation=generation)
+        return result
+
+    def _query_user(self, user, guild, windows):
         early = None
-        for row in rows:
-            logger.debug("checking row: %s", tuple(row))
-            if alltime and (early is None or row["early"] < early):
-                early = row["early"]
-            if row["voicestate"] in results:
-                results[row["voicestate"]] += row["total"]
-            else:
-                results[row["voicestate"]] = row["total"]
-        logger.debug("early time: %s", early)
+        with self._database(readonly=True) as db:
+            rows = self._voice_totals(db, USER_TOTALS, windows, user=user, guild=guild)
+            if None in windows:
+                early = db.execute(USER_EARLY, {"user": user, "guild": guild}).fetchone()["early"]
+        results = WindowTotals(
+            windows,
+            {row["voicestate"]: [row[f"w{idx}"] for idx in range(len(windows))] for row in rows},
+        )
+        return results, early
+
+    async def _user_stat(self, user, guild, windows=ROLLING):
+        logger.debug("get stats for windows: %s", windows)
+        results, early = self._cached(
+            ("user", guild.id, user, windows),
+            lambda: self._query_user(user, guild.id, windows),
+        )
+        logger.debug("user totals: %s, early time: %s", results, early)
 
         in_voice = user in [vc.user for vc in self.current]
         stats = None
@@ -512,7 +1086,7 @@ class StatsCog(Cog):
         if ctx.invoked_subcommand:
             return
 
-        output = await self._user_stat(ctx.author.id, ctx.channel.guild, alltime=False)
+        output = await self._user_stat(ctx.author.id, ctx.channel.guild)
         await ctx.send(output)
 
     @is_owner()
@@ -520,32 +1094,119 @@ class StatsCog(Cog):
     async def save(self, ctx):
         """test cog works"""
         logger.info("saving all current users and resetting info")
-        self._save_current()
+        await self._save_current()
         await ctx.send("saved :)")
 
-    @staticmethod
-    async def _get_member(guild, user):
-        pat = re.compile(r".*?" + user + r".*?", flags=re.IGNORECASE)
-        async for member in guild.fetch_members(limit=None):
-            if member.nick and pat.search(member.nick):
-                return member.id
-            if member.name and pat.search(member.name):
-                return member.id
-        return None
+    def _get_member(self, guild, user):
+        return self.members.find(guild.id, user)
+
+    def _member_names(self, guild, users):
+        """Display names from the member directory, falling back to the gateway cache"""
+        names = self.members.display_many(guild.id, users)
+        for user, name in names.items():
+            if name is None:
+                member = guild.get_member(user)
+                names[user] = (member.nick or member.name) if member else f"(user left) {user}"
+        return names
+
+    def _resolve_user(self, guild, words):
+        name = " ".join(words)
+        return int(name) if name.isdigit() else self._get_member(guild, name)
+
+    def _heatmap(self, query, binner, columns, guild, user, title):
+        """Bin the rows a chunk at a time into a weekday x hour grid and render it"""
+        grid = np.zeros((7, 24))
+        with self._database(readonly=True) as db:
+            sql = query.format(user="" if user is None else "AND user = :user")
+            rows = db.execute(sql, {"guild": guild, "user": user})
+            while chunk := rows.fetchmany(COMPRESS_CHUNK):
+                grid += binner(
+                    *(np.array([row[col] for row in chunk], dtype=np.float64) for col in columns)
+                )
+        return render_heatmap(grid, f"{title} ({TZNAME})")
+
+    async def _send_heatmap(self, ctx, kind, user):
+        """Heatmap of a user, or the whole guild without one, cached until the
+        guild's voice or message data changes"""
+        guild = ctx.channel.guild
+        user_id = None
+        if user:
+            user_id = self._resolve_user(guild, user)
+            if user_id is None:
+                await ctx.send("sorry, no user with that name found")
+                return
+        target = guild.name if user_id is None else self._member_names(guild, [user_id])[user_id]
+
+        if kind == "vc":
+            generation = guild.id
+            args = (HEATMAP_VOICE, bin_intervals, ("starttime", "endtime"))
+            title = f"Time in voice by hour: {target}"
+        else:
+            generation = ("txt", guild.id)
+            args = (HEATMAP_TXT, bin_timestamps, ("timestamp",))
+            title = f"Messages by hour: {target}"
+
+        async with ctx.typing():
+            png = await self.bot.blocker(
+                self._cached,
+                (f"{kind} heatmap", generation, user_id, (None,)),
+                lambda: self._heatmap(*args, guild.id, user_id, title),
+            )
+        await ctx.send(file=File(BytesIO(png), filename=f"{kind}-heatmap.png"))
+
+    @is_owner()
+    @vc.command(name="heatmap")
+    async def vc_heatmap(self, ctx, *user):
+        """time in voice by weekday and hour for a user or the whole guild"""
+        logger.info("getting voice heatmap")
+        await self._send_heatmap(ctx, "vc", user)
+
+    def _query_friends(self, user, guild):
+        with self._database(readonly=True) as db:
+            rows = db.execute(COPRESENCE_FRIENDS, (guild, user)).fetchall()
+        return [(row["other"], row["seconds"]) for row in rows]
+
+    @is_owner()
+    @vc.command()
+    async def friends(self, ctx, *user):
+        """who a user spends the most time in voice with, defaults to you"""
+        logger.info("getting voice friends")
+        guild = ctx.channel.guild
+        user_id = self._resolve_user(guild, user) if user else ctx.author.id
+        if user_id is None:
+            await ctx.send("sorry, no user with that name found")
+            return
+
+        friends = self._cached(
+            ("friends", guild.id, user_id, None),
+            lambda: self._query_friends(user_id, guild.id),
+        )
+        names = self._member_names(guild, [user_id] + [other for other, _ in friends])
+        output = f"```\nTime in voice with {names[user_id]}\n"
+        for idx, (other, seconds) in enumerate(friends):
+            output += f"{idx+1}. {names[other]}: {self._display_duration(seconds)}\n"
+        output += "```"
+        await ctx.send(output)
 
     @is_owner()
     @vc.command()
     async def all(self, ctx):
         """get info about any user by id"""
         logger.info("geting specific user vc data for all time")
-        output = await self._user_stat(ctx.author.id, ctx.channel.guild, alltime=True)
+        output = await self._user_stat(ctx.author.id, ctx.channel.guild, windows=(None,))
         await ctx.send(output)
 
     @is_owner()
     @vc.command()
     async def user(self, ctx, user, *extra):
-        """get info about any user by id"""
+        """get info about any user by id, trailing args like `7 30 all` pick the windows"""
         logger.info("geting specific user vc data")
+        windows = ROLLING
+        for cut in range(len(extra)):
+            if parsed := self._parse_windows(extra[cut:]):
+                windows = parsed
+                extra = extra[:cut]
+                break
         user_id = None
         try:
             # bad if user's name is an number
@@ -553,129 +1214,388 @@ class StatsCog(Cog):
             user_id = int(user)
         except ValueError:
             user = (user + " " + " ".join(extra)).strip()
-            user_id = await self._get_member(ctx.channel.guild, user)
+            user_id = self._get_member(ctx.channel.guild, user)
 
         if user_id is None:
             await ctx.send("sorry, no user with that name found")
             return
 
-        output = await self._user_stat(user_id, ctx.channel.guild)
+        output = await self._user_stat(user_id, ctx.channel.guild, windows=windows)
         await ctx.send(output)
 
-    async def _generate_top_output(self, all_, early, users, guild):
+    @staticmethod
+    def _local_day(timestamp=None):
+        timestamp = TimeTravel.timestamp() if timestamp is None else timestamp
+        return int(local_seconds(np.array([timestamp]))[0] // DAY_SECS)
+
+    @staticmethod
+    def _quarter_start():
+        """Utc timestamp of the local midnight the current quarter started at"""
+        today = datetime.datetime.fromtimestamp(TimeTravel.timestamp(), TimeTravel.tz).date()
+        midnight = datetime.datetime(today.year, 3 * ((today.month - 1) // 3) + 1, 1)
+        return int(TimeTravel.tz.localize(midnight).timestamp())
+
+    @staticmethod
+    def _daystr(day):
+        return (datetime.date(1970, 1, 1) + datetime.timedelta(days=day)).isoformat()
+
+    def _query_streaks(self, user, guild):
+        """Longest and latest runs of local days in voice as (first, last, length)"""
+        params = {"user": user, "guild": guild, "now": TimeTravel.timestamp()}
+        with self._database(readonly=True) as db:
+            rows = db.execute(VOICE_STREAKS, params).fetchall()
+        if not rows:
+            return {}
+        starts = np.array([row["starttime"] for row in rows], dtype=np.float64)
+        ends = np.array([row["endtime"] for row in rows], dtype=np.float64)
+        runs = day_runs(local_days(starts, ends))
+        return {
+            "longest": max(runs, key=lambda run: (run[2], run[1])),
+            "latest": runs[-1],
+        }
+
+    @is_owner()
+    @vc.command()
+    async def streak(self, ctx, *user):
+        """longest and current run of days in voice, defaults to you"""
+        logger.info("getting voice streak")
+        guild = ctx.channel.guild
+        user_id = self._resolve_user(guild, user) if user else ctx.author.id
+        if user_id is None:
+            await ctx.send("sorry, no user with that name found")
+            return
+
+        streaks = await self.bot.blocker(
+            self._cached,
+            ("streak", guild.id, user_id, None),
+            lambda: self._query_streaks(user_id, guild.id),
+        )
+        name = self._member_names(guild, [user_id])[user_id]
+        if not streaks:
+            await ctx.send(f"{name} hasn't been in voice")
+            return
+
+        first, last, length = streaks["longest"]
+        _, latest, current = streaks["latest"]
+        current = current if latest >= self._local_day() - 1 else 0
+        output = (
+            f"```\nVoice streaks of {name}\n"
+            f"Longest: {length} days ({self._daystr(first)} to {self._daystr(last)})\n"
+            f"Current: {current} days\n"
+            "```"
+        )
+        await ctx.send(output)
+
+    def _query_rank(self, user, guild, since):
+        with self._database(readonly=True) as db:
+            if not self._rollups_ready(db):
+                return False, None
+            params = {"user": user, "guild": guild, "since": since, "day": since // DAY_SECS}
+            return True, db.execute(VOICE_RANK, params).fetchone()
+
+    @is_owner()
+    @vc.command()
+    async def rank(self, ctx, *user):
+        """where a user's voice time this quarter ranks in the guild, defaults to you"""
+        logger.info("getting voice rank")
+        guild = ctx.channel.guild
+        user_id = self._resolve_user(guild, user) if user else ctx.author.id
+        if user_id is None:
+            await ctx.send("sorry, no user with that name found")
+            return
+
+        since = self._quarter_start()
+        ready, row = await self.bot.blocker(
+            self._cached,
+            ("rank", guild.id, user_id, since),
+            lambda: self._query_rank(user_id, guild.id, since),
+        )
+        if not ready:
+            await ctx.send("daily voice totals are still being built, try again later")
+            return
+        name = self._member_names(guild, [user_id])[user_id]
+        if row is None:
+            await ctx.send(f"{name} hasn't been in voice this quarter")
+            return
+        output = (
+            f"```\n{name} is in the top {max(row['top'] * 100, 1):.0f}% of voice time "
+            f"this quarter\n"
+            f"#{row['place']} of {row['members']} with {self._display_duration(row['total'])}\n"
+            "```"
+        )
+        await ctx.send(output)
+
+    @staticmethod
+    def _parse_when(args):
+        """Local `YYYY-MM-DD [HH:MM[:SS]]` at the start of the args as the utc
+        (start, end) it covers, the whole day when there's no time, and the
+        rest of the args, or None if it doesn't start with a date"""
+        try:
+            day = datetime.datetime.strptime(args[0], "%Y-%m-%d")
+        except (IndexError, ValueError):
+            return None
+        for fmt in ("%H:%M:%S", "%H:%M"):
+            try:
+                clock = datetime.datetime.strptime(args[1], fmt).time()
+            except (IndexError, ValueError):
+                continue
+            when = TimeTravel.tz.localize(datetime.datetime.combine(day, clock)).timestamp()
+            return when, when, args[2:]
+        start = TimeTravel.tz.localize(day)
+        end = TimeTravel.tz.localize(day + datetime.timedelta(days=1))
+        return start.timestamp(), end.timestamp(), args[1:]
+
+    @staticmethod
+    def _resolve_channel(guild, words):
+        name = " ".join(words)
+        if name.isdigit():
+            return int(name)
+        for channel in guild.voice_channels + guild.stage_channels:
+            if channel.name.casefold() == name.lstrip("#").casefold():
+                return channel.id
+        return None
+
+    @staticmethod
+    def _channel_name(guild, channel):
+        found = guild.get_channel(channel)
+        return found.name if found else f"(channel gone) {channel}"
+
+    def _query_spans(self, guild, start, end, channel=None):
+        with self._database(readonly=True) as db:
+            query = VOICE_SPANS.indexed if self._migrated(db, SPAN_VERSION) else VOICE_SPANS.raw
+            where = "AND channel = :channel" if channel else ""
+            sql = query.format(channel=where) + OPEN_SPANS.format(channel=where)
+            params = {
+                "guild": guild,
+                "start": start,
+                "end": end,
+                "channel": channel,
+                "now": TimeTravel.timestamp(),
+            }
+            return [
+                (row["user"], row["channel"], row["starttime"], row["endtime"])
+                for row in db.execute(sql, params)
+            ]
+
+    @staticmethod
+    def _occupancy(spans, start, end):
+        """Merge a channel's sessions, clipped to [start, end], into the
+        stretches it was occupied as (start, end, peak, users)"""
+        events = []
+        for user, _, joined, left in spans:
+            joined, left = max(joined, start), min(left, end)
+            if joined < left:
+                events.append((joined, 1, user))
+                events.append((left, -1, user))
+        # leaving sorts before joining at the same moment so back to back
+        # sessions don't look like one person twice
+        events.sort(key=lambda event: event[:2])
+        stretches = []
+        count, opened, peak, users = 0, None, 0, set()
+        for when, step, user in events:
+            if count == 0:
+                opened, peak, users = when, 0, set()
+            count += step
+            if step > 0:
+                users.add(user)
+                peak = max(peak, count)
+            elif count == 0:
+                stretches.append((opened, when, peak, users))
+        return stretches
+
+    @staticmethod
+    def _local_clock(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp, TimeTravel.tz).strftime("%H:%M")
+
+    @staticmethod
+    def _spans_output(title, lines):
+        output = f"```\n{title}\n"
+        for line in lines:
+            if len(output) + len(line) + len("...\n```") > MAX_MESSAGE:
+                output += "...\n"
+                break
+            output += line
+        output += "```"
+        return output
+
+    @is_owner()
+    @vc.command()
+    async def at(self, ctx, *args):
+        """who was in voice at `YYYY-MM-DD HH:MM`, or each channel's timeline for a
+        whole day with just the date, optionally only in one channel"""
+        logger.info("getting voice at a time")
+        guild = ctx.channel.guild
+        parsed = self._parse_when(args)
+        if parsed is None:
+            await ctx.send("give a local time like `2024-03-02 21:00` or a day like `2024-03-02`")
+            return
+        start, end, rest = parsed
+        channel = None
+        if rest:
+            channel = self._resolve_channel(guild, rest)
+            if channel is None:
+                await ctx.send("sorry, no voice channel with that name found")
+                return
+
+        spans = await self.bot.blocker(self._query_spans, guild.id, start, end, channel)
+        names = self._member_names(guild, {span[0] for span in spans})
+        by_channel = {}
+        for span in sorted(spans, key=lambda span: span[1]):
+            by_channel.setdefault(span[1], []).append(span)
+
+        lines = []
+        if start == end:
+            title = f"In voice at {args[0]} {args[1]}"
+            for chan, chan_spans in by_channel.items():
+                users = ", ".join(sorted(names[span[0]] for span in chan_spans))
+                lines.append(f"{self._channel_name(guild, chan)}: {users}\n")
+        else:
+            title = f"Voice on {args[0]}"
+            for chan, chan_spans in by_channel.items():
+                lines.append(f"{self._channel_name(guild, chan)}\n")
+                for opened, closed, peak, users in self._occupancy(chan_spans, start, end):
+                    who = ", ".join(sorted(names[user] for user in users))
+                    lines.append(
+                        f"  {self._local_clock(opened)}-{self._local_clock(closed)} "
+                        f"(peak {peak}): {who}\n"
+                    )
+        if not lines:
+            lines.append("nobody\n")
+        await ctx.send(self._spans_output(title, lines))
+
+    async def _generate_top_output(self, early, users, guild):
         """Generate the discord message to display the top users"""
+        names = list(self._member_names(guild, users.totals).values())
+
+        windows = users.windows
         output = "```\n"
-        if not all_:
-            output += f"Last {ROLLING[0]} days\n"
+        if len(windows) > 1:
+            rows = [
+                (f"{idx+1}. {name}", values)
+                for idx, (name, values) in enumerate(zip(names, users.totals.values()))
+            ]
+            output += self._window_table(rows, windows, early)
         else:
-            output += f"Since {TimeTravel.pretty_ts(early)}\n"
-        for idx, (user, value) in enumerate(users):
-            try:
-                member = await guild.fetch_member(user)
-            except NotFound:
-                name = f"(user left) {user}"
+            if windows[0] is not None:
+                output += f"Last {windows[0]} days\n"
+            elif early:
+                output += f"Since {TimeTravel.pretty_ts(early)}\n"
             else:
-                name = member.nick or member.name
-            val = self._display_duration(value)
-            output += f"{idx+1}. {name}: {val}\n"
+                output += "All time\n"
+            for idx, (name, (value,)) in enumerate(zip(names, users.totals.values())):
+                val = self._display_duration(value)
+                output += f"{idx+1}. {name}: {val}\n"
         output += "```"
         return output
 
+    @staticmethod
+    def _early(db):
+        """Earliest session start, kept up to date in Timestamps as sessions close"""
+        row = db.execute("SELECT ts FROM Timestamps WHERE name = 'early'").fetchone()
+        if row is None:
+            row = db.execute("SELECT min(starttime) as ts FROM History").fetchone()
+        return row["ts"]
+
+    def _query_top(self, guild, windows):
+        early = None
+        with self._database(readonly=True) as db:
+            if None in windows:
+                early = self._early(db)
+            rows = self._voice_totals(db, TOP_TOTALS, windows, guild=guild)
+        users = WindowTotals(
+            windows,
+            {r["user"]: [r[f"w{idx}"] for idx in range(len(windows))] for r in rows},
+        )
+        return users, early
+
+    @is_owner()
+    @vc.command()
+    async def cache(self, ctx):
+        """Hit and miss counts of the stats result cache"""
+        stats = self.results.stats()
+        total = stats["hits"] + stats["misses"]
+        rate = stats["hits"] / total if total else 0
+        await ctx.send(
+            f"```\n{stats['size']} results cached\n"
+            f"{stats['hits']} hits, {stats['misses']} misses ({rate:.0%} hit rate)\n```"
+        )
+
     @is_owner()
     @vc.command()
-    async def top(self, ctx, all_=None):
-        """Get top 10 users from each guild"""
+    async def top(self, ctx, *windows):
+        """Get top 10 users from each guild, ranked by the first window of `7 30 all`"""
         logger.info("getting top users for guild")
+        windows = self._parse_windows(windows) or ((None,) if windows else ROLLING)
         async with ctx.typing():
             guild = ctx.channel.guild
 
-            early = None
-            rows = []
-            since = TimeTravel.tsinpast(*ROLLING)
-            with self._database(readonly=True) as db:
-                if all_:
-                    early = db.execute(
-                        """
-                        SELECT min(starttime) as early
-                        FROM History
-                        GROUP BY starttime
-                        LIMIT 1
-                        """
-                    ).fetchone()["early"]
-                    rows = db.execute(
-                        """
-                        SELECT user, sum(duration) as total
-                        FROM History
-                        WHERE guild = ? AND voicestate = "voice"
-                        GROUP BY user
-                        ORDER BY total DESC
-                        LIMIT 10
-                        """,
-                        (guild.id,),
-                    ).fetchall()
-                else:
-                    rows = db.execute(
-                        """
-                        SELECT user, sum(duration) as total
-                        FROM History
-                        WHERE guild = ? AND voicestate = "voice" AND starttime > ?
-                        GROUP BY user
-                        ORDER BY total DESC
-                        LIMIT 10
-                        """,
-                        (guild.id, since),
-                    ).fetchall()
-            users = [(r["user"], r["total"]) for r in rows]
-            output = await self._generate_top_output(all_, early, users, guild)
+            users, early = self._cached(
+                ("top", guild.id, None, windows),
+                lambda: self._query_top(guild.id, windows),
+            )
+            output = await self._generate_top_output(early, users, guild)
             await ctx.send(output)
 
-    def _compress_database(self):
+    @staticmethod
+    def _compress_chunk_end(db, cursor):
+        """Last user of the next chunk, every row of a user is in the same chunk"""
+        row = db.execute(COMPRESS_CHUNK_END, (cursor, COMPRESS_CHUNK - 1)).fetchone()
+        if row is None:
+            row = db.execute(
+                "SELECT max(user) AS user FROM History WHERE user > ?", (cursor,)
+            ).fetchone()
+        return row["user"]
+
+    def _compress_database(self, force=False):
+        """Remove all but the longest row of each session in bounded chunks of users
+
+        Each chunk is its own short transaction that also records the progress,
+        with a pause between them so voice and message writes aren't held up.
+        Returns the number of rows removed and the seconds taken, or None if the
+        last run was too recent.
+        """
         start = time()
         with self._database(readonly=True) as db:
-            last = db.execute("""SELECT ts FROM Timestamps WHERE name = 'compress'""").fetchone()
-            since_last = start - COMPRESS_WAIT
-            if last is not None and since_last <= last["ts"]:
-                logger.debug("No need to compress, compressed less than a week ago: %s", localtime(last))
-                return
+            last = db.execute("SELECT ts FROM Timestamps WHERE name = 'compress'").fetchone()
+            progress = db.execute("SELECT * FROM Compaction WHERE id = 1").fetchone()
+        resuming = progress is not None and progress["cursor"] is not None
+        if not force and not resuming and last is not None and start - COMPRESS_WAIT <= last["ts"]:
+            logger.debug(
+                "No need to compress, compressed less than a week ago: %s", localtime(last["ts"])
+            )
+            return None
 
-        logger.debug("Starting db compression: %s", localtime(start))
-        deletes = []
-        max_durs = []
-        with self._database(readonly=True) as db:
-            max_durs = db.execute(
-                """
-                SELECT user, channel, voicestate, h_time, max(duration) as maxdur
-                FROM History
-                GROUP BY user, channel, voicestate, h_time
-                """
-            ).fetchall()
-        for max_dur in max_durs:
-            deletes.append((
-                max_dur["user"],
-                max_dur["channel"],
-                max_dur["voicestate"],
-                max_dur["h_time"],
-                max_dur["maxdur"],
-            ))
+        if resuming:
+            cursor, removed = progress["cursor"], progress["removed"]
+            logger.debug("Resuming db compression after user %s: %s", cursor, localtime(start))
+        else:
+            cursor, removed = -1, 0
+            logger.debug("Starting db compression: %s", localtime(start))
+            with self._database() as db:
+                db.execute(COMPRESS_START, (start,))
+
+        while True:
+            with self._database() as db:
+                end = self._compress_chunk_end(db, cursor)
+                if end is None:
+                    break
+                db.execute(COMPRESS_DELETE, (cursor, end))
+                removed += db.rowcount
+                db.execute(
+                    "UPDATE Compaction SET cursor = ?, removed = ? WHERE id = 1", (end, removed)
+                )
+            cursor = end
+            sleep(COMPRESS_PAUSE)
+
+        finish = time()
         with self._database() as db:
-            db.executemany(
-                """
-                DELETE FROM History
-                WHERE
-                    user = ? AND
-                    channel = ? AND
-                    voicestate = ? AND
-                    h_time = ? AND
-                    duration != ?
-                """,
-                deletes,
-            )
-            if last is None:
-                db.execute("""INSERT INTO Timestamps VALUES (compress, ?)""", (start,))
-            else:
-                db.execute("""UPDATE Timestamps SET ts = ? WHERE name = compress""", (start,))
-        end = time()
-        logger.debug("Completed db compression in %s seconds: %s", end - start, localtime(end))
+            db.execute("UPDATE Compaction SET cursor = NULL, finished = ? WHERE id = 1", (finish,))
+            db.execute(COMPRESS_MARK, (finish,))
+        self.results.clear()
+        logger.info(
+            "Completed db compression, removed %s rows in %s seconds", removed, finish - start
+        )
+        return removed, finish - start
 
     @loop(time=COMPRESS_TIME)
     async def periodic_compress(self):
@@ -696,20 +1616,35 @@ class StatsCog(Cog):
     async def compress(self, ctx):
         """Remove duplicate duration entries"""
         logger.info("removing duplicate duration entries")
-        await self.bot.blocker(self._compress_database)
-        await ctx.message.add_reaction("👍")
+        async with ctx.typing():
+            removed, seconds = await self.bot.blocker(self._compress_database, force=True)
+        await ctx.send(f"removed {removed} duplicate rows in {seconds:.1f} seconds")
 
     #########################
     ### MessageProcessing ###
     #########################
 
+    def _get_message_authors(self, mids):
+        """Authors of the messages from the author cache, the rest looked up
+        all at once, messages with no known author are left out"""
+        authors = {}
+        missing = []
+        for mid in mids:
+            if (author := self.authors.get(mid)) is not None:
+                authors[mid] = author
+            else:
+                missing.append(mid)
+        if missing:
+            with self._database(readonly=True) as db:
+                rows = db.execute(MESSAGE_AUTHORS, (dumps(missing),))
+                for row in rows:
+                    authors[row["message"]] = int(row["user"])
+                    self.authors.put(row["message"], int(row["user"]))
+        return authors
+
     def _get_message_author(self, mid):
         if mid:
-            with self._database(readonly=True) as db:
-                rows = db.execute("""SELECT user FROM Message WHERE message = ? LIMIT 1;""", (mid,))
-                res = rows.fetchone()
-                if res:
-                    return int(res["user"])
+            return self._get_message_authors([mid]).get(mid)
         return None
 
     @staticmethod
@@ -755,6 +1690,7 @@ class StatsCog(Cog):
 
         if event == "create":
             msg.aid = message.author.id
+            self.authors.put(msg.mid, msg.aid)
             self._set_message_data(msg, message)
             msg.tstp = message.created_at.timestamp()
 
@@ -779,18 +1715,18 @@ class StatsCog(Cog):
                 if payload.data.get("edited_timestamp"):
                     msg.tstp = TimeTravel.tsfromdiscord(payload.data.get("edited_timestamp"))
 
-        msg.tsc = TimeTravel.sqlts(msg.tstp)
+        # backfilled rows get theirs a chunk at a time in _write_history
+        if not hist:
+            msg.tsc = TimeTravel.sqlts(msg.tstp)
 
         if event == "delete":
             if msg.mid is None:
-                mids = {}
-                for tmid in payload.message_ids:
-                    cached = [cmsg.author.id for cmsg in payload.cached_messages if cmsg.id == tmid]
-                    mids[tmid] = cached[0] if cached else self._get_message_author(tmid)
-                entries = []
-                for tmid, taid in mids.items():
-                    entries.append((tmid, taid, *msg.delete()))
-                return entries
+                authors = {cmsg.id: cmsg.author.id for cmsg in payload.cached_messages}
+                authors.update(
+                    self._get_message_authors(set(payload.message_ids) - authors.keys())
+                )
+                deleted = msg.delete()
+                return [(tmid, authors.get(tmid), *deleted) for tmid in payload.message_ids]
             msg.aid = (
                 payload.cached_message.author.id
                 if payload.cached_message
@@ -799,6 +1735,16 @@ class StatsCog(Cog):
 
         return msg.to_tuple()
 
+    def _write_messages(self, entries):
+        with self._database() as db:
+            db.executemany(MSG_INSERT, entries)
+        self.results.bump(*{("txt", entry[2]) for entry in entries})
+
+    @loop(seconds=0)
+    async def message_writer(self):
+        """the one task writing the queued message events, a batch at a time"""
+        await self.messages.drain(self.bot.blocker)
+
     @Cog.listener("on_message")
     async def process_on_message(self, message):
         """Process message details"""
@@ -814,8 +1760,7 @@ class StatsCog(Cog):
             len(message.embeds),
         )
 
-        with self._database() as db:
-            db.execute(MSG_INSERT, data)
+        await self.messages.put(data)
 
     @Cog.listener("on_raw_message_edit")
     async def process_on_message_edit(self, payload):
@@ -829,8 +1774,7 @@ class StatsCog(Cog):
             payload.data.get("content"),
         )
 
-        with self._database() as db:
-            db.execute(MSG_INSERT, data)
+        await self.messages.put(data)
 
     @Cog.listener("on_raw_message_delete")
     async def process_on_message_delete(self, payload):
@@ -840,8 +1784,7 @@ class StatsCog(Cog):
 
         logger.debug("message %s deleted", payload.message_id)
 
-        with self._database() as db:
-            db.execute(MSG_INSERT, data)
+        await self.messages.put(data)
 
     @Cog.listener("on_raw_bulk_message_delete")
     async def process_on_message_bulk_delete(self, payload):
@@ -851,8 +1794,161 @@ class StatsCog(Cog):
 
         logger.debug("bulk message delete: %s", payload.message_ids)
 
+        await self.messages.put(*entries)
+
+    #########################
+    ###     Reactions     ###
+    #########################
+
+    def _write_reactions(self, batches):
+        """Write reaction events in a single transaction, one executemany per run"""
         with self._database() as db:
-            db.executemany(MSG_INSERT, entries)
+            for sql, rows in batches:
+                db.executemany(sql, rows)
+
+    def _take_reactions(self):
+        """The queued reaction events, None if there aren't any"""
+        batches = self.reactions.drain()
+        return (batches,) if batches else None
+
+    async def _flush_reactions(self):
+        """Write the queued reaction events"""
+        batch = await self._flush(
+            "reaction events", self._take_reactions, self._write_reactions, self.reactions.restore
+        )
+        if batch is None:
+            return 0
+        return sum(len(rows) for _, rows in batch[0])
+
+    async def _queue_reaction(self, sql, params):
+        if self.reactions.push(sql, params):
+            await self._flush_reactions()
+
+    @Cog.listener("on_raw_reaction_add")
+    async def reaction_add(self, payload):
+        """Queue a reaction added to a guild message"""
+        if payload.guild_id is None or (payload.member and payload.member.bot):
+            return
+        await self._queue_reaction(
+            REACT_ADD,
+            (
+                payload.message_id,
+                payload.user_id,
+                str(payload.emoji),
+                payload.guild_id,
+                payload.channel_id,
+                self.authors.get(payload.message_id),
+                TimeTravel.timestamp(),
+            ),
+        )
+
+    @Cog.listener("on_raw_reaction_remove")
+    async def reaction_remove(self, payload):
+        """Queue a reaction taken off a guild message"""
+        if payload.guild_id is None:
+            return
+        await self._queue_reaction(
+            REACT_REMOVE, (payload.message_id, payload.user_id, str(payload.emoji))
+        )
+
+    @Cog.listener("on_raw_reaction_clear")
+    async def reaction_clear(self, payload):
+        """Queue all the reactions cleared off a guild message"""
+        if payload.guild_id is None:
+            return
+        await self._queue_reaction(REACT_CLEAR, (payload.message_id,))
+
+    @Cog.listener("on_raw_reaction_clear_emoji")
+    async def reaction_clear_emoji(self, payload):
+        """Queue one emoji's reactions cleared off a guild message"""
+        if payload.guild_id is None:
+            return
+        await self._queue_reaction(REACT_CLEAR_EMOJI, (payload.message_id, str(payload.emoji)))
+
+    @loop(seconds=REACT_FLUSH_SECS)
+    async def periodic_reactions(self):
+        """periodically write the queued reaction events"""
+        await self.bot.wait_until_ready()
+        if flushed := await self._flush_reactions():
+            logger.debug(
+                "flushed %s reaction events, next at %s",
+                flushed,
+                # function transformed by the @loop annotation
+                # pylint: disable=no-member
+                self.periodic_reactions.next_iteration,
+            )
+
+    def _activity_totals(self, group, where, params):
+        with self._database(readonly=True) as db:
+            sql = ACTIVITY_TOTALS.format(group=group, filter=where)
+            return db.execute(sql, params).fetchall()
+
+    def _guild_members(self, guild):
+        return dumps(list(self.members.members.get(guild.id, {})))
+
+    @staticmethod
+    def _activity_label(row):
+        return f"{row['name']} ({row['kind']})"
+
+    def _activity_output(self, title, rows, label):
+        output = f"```\n{title}\n"
+        for idx, row in enumerate(rows):
+            output += f"{idx+1}. {label(row)}: {self._display_duration(row['total'])}\n"
+        output += "```"
+        return output
+
+    async def _user_activities(self, ctx, user_id):
+        guild = ctx.channel.guild
+        rows = await self.bot.blocker(
+            self._activity_totals, "kind, name", "user = :user", {"user": user_id}
+        )
+        name = self._member_names(guild, [user_id])[user_id]
+        title = f"Top activities of {name}"
+        await ctx.send(self._activity_output(title, rows, self._activity_label))
+
+    @is_owner()
+    @bridge_group()
+    async def act(self, ctx):
+        """get the top activities of the user"""
+        if ctx.invoked_subcommand:
+            return
+        await self._user_activities(ctx, ctx.author.id)
+
+    @is_owner()
+    @act.command(name="user")
+    async def act_user(self, ctx, *user):
+        """get the top activities of any user by name or id"""
+        user_id = self._resolve_user(ctx.channel.guild, user)
+        if user_id is None:
+            await ctx.send("sorry, no user with that name found")
+            return
+        await self._user_activities(ctx, user_id)
+
+    @is_owner()
+    @act.command(name="top")
+    async def act_top(self, ctx, kind=None):
+        """top activities of the guild's members, optionally only one kind like `playing`"""
+        guild = ctx.channel.guild
+        where = "user IN (SELECT value FROM json_each(:members))"
+        if kind:
+            where += " AND kind = :kind"
+        params = {"members": self._guild_members(guild), "kind": kind}
+        rows = await self.bot.blocker(self._activity_totals, "kind, name", where, params)
+        title = f"Top activities in {guild.name}"
+        await ctx.send(self._activity_output(title, rows, self._activity_label))
+
+    @is_owner()
+    @act.command(name="who")
+    async def act_who(self, ctx, *activity):
+        """members of the guild with the most time in an activity"""
+        guild = ctx.channel.guild
+        name = " ".join(activity)
+        where = "user IN (SELECT value FROM json_each(:members)) AND name = :name COLLATE NOCASE"
+        params = {"members": self._guild_members(guild), "name": name}
+        rows = await self.bot.blocker(self._activity_totals, "user", where, params)
+        names = self._member_names(guild, [row["user"] for row in rows])
+        title = f"Most time in {name}"
+        await ctx.send(self._activity_output(title, rows, lambda row: names[row["user"]]))
 
     @is_owner()
     @bridge_group()
@@ -861,6 +1957,75 @@ class StatsCog(Cog):
         if ctx.invoked_subcommand:
             return
 
+    @is_owner()
+    @txt.command(name="heatmap")
+    async def txt_heatmap(self, ctx, *user):
+        """messages sent by weekday and hour for a user or the whole guild"""
+        logger.info("getting message heatmap")
+        await self._send_heatmap(ctx, "txt", user)
+
+    def _query_reacts(self, guild):
+        with self._database(readonly=True) as db:
+            emoji = db.execute(REACT_EMOJI_TOP, (guild,)).fetchall()
+            received = db.execute(REACT_USER_TOP.format(column="received"), (guild,)).fetchall()
+            given = db.execute(REACT_USER_TOP.format(column="given"), (guild,)).fetchall()
+        return emoji, received, given
+
+    @staticmethod
+    def _emoji_label(emoji):
+        # custom emoji are stored as <:name:id>, which a code block shows raw
+        if emoji.startswith("<"):
+            return f":{emoji.split(':')[1]}:"
+        return emoji
+
+    @is_owner()
+    @txt.command()
+    async def reacts(self, ctx):
+        """most used reactions and the members giving and getting the most"""
+        logger.info("getting reaction leaderboards")
+        guild = ctx.channel.guild
+        emoji, received, given = await self.bot.blocker(self._query_reacts, guild.id)
+        names = self._member_names(guild, {row["user"] for row in received + given})
+
+        output = "```\nMost used reactions\n"
+        for idx, row in enumerate(emoji):
+            output += f"{idx+1}. {self._emoji_label(row['emoji'])}: {row['count']}\n"
+        output += "\nMost reacted to\n"
+        for idx, row in enumerate(received):
+            output += f"{idx+1}. {names[row['user']]}: {row['count']}\n"
+        output += "\nMost reactions given\n"
+        for idx, row in enumerate(given):
+            output += f"{idx+1}. {names[row['user']]}: {row['count']}\n"
+        output += "```"
+        await ctx.send(output)
+
+    @is_owner()
+    @txt.command(name="cache")
+    async def txt_cache(self, ctx):
+        """Hit and miss counts of the message author cache"""
+        stats = self.authors.stats()
+        total = stats["hits"] + stats["misses"]
+        rate = stats["hits"] / total if total else 0
+        await ctx.send(
+            f"```\n{stats['size']} message authors cached (limit {self.authors.max_size})\n"
+            f"{stats['hits']} hits, {stats['misses']} misses ({rate:.0%} hit rate)\n```"
+        )
+
+    @is_owner()
+    @txt.command()
+    async def queue(self, ctx):
+        """Depth and write latency of the message event queue"""
+        stats = self.messages.stats()
+        await ctx.send(
+            f"```\n{stats['depth']} queued (peak {stats['peak']}, "
+            f"limit {self.messages.max_rows})\n"
+            f"{stats['written']} written in {stats['flushes']} batches, "
+            f"{stats['failures']} failed\n"
+            f"{stats['waits']} waits for room\n"
+            f"write latency {stats['median'] * 1000:.1f} ms median, "
+            f"{stats['max'] * 1000:.1f} ms max\n```"
+        )
+
     async def _hist_message(self, tstp, message):
         entries = []
         if message.created_at:
@@ -881,23 +2046,52 @@ class StatsCog(Cog):
             entries.append(data)
         return entries
 
+    def _history_cursor(self, name):
+        """Last message of an unfinished backfill to resume after, if any"""
+        with self._database(readonly=True) as db:
+            row = db.execute("SELECT * FROM Backfill WHERE name = ?", (name,)).fetchone()
+        return row["cursor"] if row and row["finished"] is None else None
+
+    def _write_history(self, name, entries, cursor, finished=None):
+        """Commit a chunk of backfilled messages along with its checkpoint"""
+        tscs = TimeTravel.sqlts_many(entry[4] for entry in entries)
+        entries = [(*entry[:-1], tsc) for entry, tsc in zip(entries, tscs)]
+        with self._database() as db:
+            db.executemany(MSG_INSERT, entries)
+            db.execute(HISTORY_MARK, (name, cursor, finished))
+        self.results.bump(*{("txt", entry[2]) for entry in entries})
+        return len(entries)
+
+    async def _history(self, ctx, tstp, source, since):
+        """Stream a channel or thread's messages into the database a chunk at a
+        time, each committed with a checkpoint so an interrupted backfill picks
+        up after the last chunk written instead of starting over"""
+        name = f"history {source.id} {since.isoformat()}"
+        cursor = await self.bot.blocker(self._history_cursor, name)
+        after = Object(id=cursor) if cursor else since
+        committed = 0
+        resuming = f" (resuming after {cursor})" if cursor else ""
+        msg = await ctx.send(f"{source.name}: saved {committed}{resuming}")
+
+        entries = []
+        last = None
+        async for message in source.history(limit=None, oldest_first=True, after=after):
+            entries.extend(await self._hist_message(tstp, message))
+            last = message.id
+            if len(entries) >= HISTORY_CHUNK:
+                committed += await self.bot.blocker(self._write_history, name, entries, last)
+                entries = []
+                await msg.edit(f"{source.name}: saved {committed}")
+
+        committed += await self.bot.blocker(
+            self._write_history, name, entries, last, TimeTravel.timestamp()
+        )
+        logger.debug("hist for %s: %s", source.name, committed)
+        await msg.edit(f"{source.name}: updated {committed}")
+
     async def _td(self, ctx, tstp, ckch, since):
         for thread in ckch.threads:
-            entries = []
-            total = 0
-            msg = await ctx.send(f"{thread.name}: downloaded {total}")
-            async for message in thread.history(limit=None, oldest_first=True, after=since):
-                cur_entries = await self._hist_message(tstp, message)
-                entries.extend(cur_entries)
-                total += 1
-                if not total % 100:
-                    await msg.edit(f"{thread.name}: downloaded {total}")
-
-            logger.debug("hist for %s: %s", ckch.name, len(entries))
-            with self._database() as db:
-                db.executemany(MSG_INSERT, entries)
-
-            await msg.edit(f"{thread.name}: updated {len(entries)}")
+            await self._history(ctx, tstp, thread, since)
 
         try:
             archived_threads = ckch.archived_threads(private=False, joined=False, limit=None)
@@ -905,21 +2099,7 @@ class StatsCog(Cog):
             pass
         else:
             async for thread in archived_threads:
-                entries = []
-                total = 0
-                msg = await ctx.send(f"{thread.name}: downloaded {total}")
-                async for message in thread.history(limit=None, oldest_first=True, after=since):
-                    cur_entries = await self._hist_message(tstp, message)
-                    entries.extend(cur_entries)
-                    total += 1
-                    if not total % 100:
-                        await msg.edit(f"{thread.name}: downloaded {total}")
-
-                logger.debug("hist for %s: %s", thread.name, len(entries))
-                with self._database() as db:
-                    db.executemany(MSG_INSERT, entries)
-
-                await msg.edit(f"{thread.name}: updated {len(entries)}")
+                await self._history(ctx, tstp, thread, since)
 
     async def _ch(self, ctx, tstp, ckch, since):
         try:
@@ -929,21 +2109,7 @@ class StatsCog(Cog):
             return
 
         logger.debug("downloading messages for channel %s since %s", ckch.name, since)
-        entries = []
-        total = 0
-        msg = await ctx.send(f"{ckch.name}: downloaded {total}")
-        async for message in ckch.history(limit=None, oldest_first=True, after=since):
-            cur_entries = await self._hist_message(tstp, message)
-            entries.extend(cur_entries)
-            total += 1
-            if not total % 100:
-                await msg.edit(f"{ckch.name}: downloaded {total}")
-
-        logger.debug("hist for %s: %s", ckch.name, len(entries))
-        with self._database() as db:
-            db.executemany(MSG_INSERT, entries)
-
-        await msg.edit(f"{ckch.name}: updated {len(entries)}")
+        await self._history(ctx, tstp, ckch, since)
         await self._td(ctx, tstp, ckch, since)
 
     @is_owner()
@@ -1,3 +1,5 @@
+PRAGMA auto_vacuum=INCREMENTAL;
+
 CREATE TABLE IF NOT EXISTS Arc(
     number PRIMARY KEY,
     name TEXT UNIQUE NOT NULL,
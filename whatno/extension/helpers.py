@@ -1,23 +1,34 @@
 """Helper methods for the Whatno Cogs"""
 
+import asyncio
+import logging
 import re
+import unicodedata
 
 # from asyncio import to_thread
 from datetime import datetime, timedelta
 
+from collections import OrderedDict, deque
+
 # from functools import wraps, partial
+from functools import lru_cache
+from hashlib import blake2b
 from html.parser import HTMLParser
 from io import StringIO, UnsupportedOperation
 from json import dumps
 from math import floor
 from os import fsync
 from pathlib import Path
-from sqlite3 import connect
+from sqlite3 import Error as SQLError
+from sqlite3 import complete_statement, connect
+from time import perf_counter, sleep, time
 
 from pytz import timezone
 from tinydb import JSONStorage, TinyDB
 from tinydb.table import Table
 
+logger = logging.getLogger(__name__)
+
 
 def calc_path(filename):
     """Calculate a filepath based off of current file"""
@@ -91,6 +102,386 @@ class CleanHTML(HTMLParser):
         return self.text.getvalue()
 
 
+class HTMLCleaner:
+    """Reusable html cleaner, strips the handful of simple tags snap.fan
+    uses with a regex and only falls back to CleanHTML for anything else.
+    Results are cached by a hash of the input.
+    """
+
+    SIMPLE_TAGS = re.compile(
+        r"</?(?:b|i|u|em|strong|br|p|span|div)(?:\s[^<>]*)?/?>",
+        flags=re.IGNORECASE,
+    )
+    MAX_CACHE = 4096
+
+    def __init__(self, max_cache=MAX_CACHE):
+        self.max_cache = max_cache
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(data):
+        return blake2b(data.encode("utf-8"), digest_size=16).digest()
+
+    def _clean(self, data):
+        if "&" not in data:
+            text = self.SIMPLE_TAGS.sub("", data)
+            if "<" not in text:
+                return text
+        return CleanHTML().process(data)
+
+    def process(self, data):
+        """clean up given html and return it"""
+        key = self._key(data)
+        text = self.cache.get(key)
+        if text is not None:
+            self.hits += 1
+            return text
+        self.misses += 1
+        text = self._clean(data)
+        if len(self.cache) >= self.max_cache:
+            del self.cache[next(iter(self.cache))]
+        self.cache[key] = text
+        return text
+
+    def process_many(self, datas):
+        """clean up a batch of html strings, returned in the same order"""
+        return [self.process(data) for data in datas]
+
+
+class MemberDirectory:
+    """Per guild index of member names, kept current from gateway events so
+    names can be looked up without going to the api.
+
+    Names are normalized (accents stripped, casefolded, whitespace collapsed)
+    and every normalized name is indexed by its trigrams for fuzzy lookups.
+    """
+
+    MIN_SCORE = 0.3
+
+    def __init__(self):
+        # guild -> user -> (nick, name)
+        self.members = {}
+        # guild -> normalized name -> user ids
+        self.names = {}
+        # guild -> trigram -> normalized names
+        self.trigrams = {}
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def normalize(name):
+        """Lowercase name without accents or extra whitespace"""
+        decomposed = unicodedata.normalize("NFKD", name)
+        stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+        return " ".join(stripped.casefold().split())
+
+    @staticmethod
+    def _trigrams(norm):
+        return {norm[idx : idx + 3] for idx in range(len(norm) - 2)} or {norm}
+
+    def _index(self, guild, user, nick, name):
+        names = self.names.setdefault(guild, {})
+        trigrams = self.trigrams.setdefault(guild, {})
+        for value in {nick, name} - {None}:
+            norm = self.normalize(value)
+            if norm not in names:
+                names[norm] = set()
+                for tri in self._trigrams(norm):
+                    trigrams.setdefault(tri, set()).add(norm)
+            names[norm].add(user)
+
+    def _unindex(self, guild, user, nick, name):
+        names = self.names.get(guild, {})
+        trigrams = self.trigrams.get(guild, {})
+        for value in {nick, name} - {None}:
+            norm = self.normalize(value)
+            users = names.get(norm, set())
+            users.discard(user)
+            if users:
+                continue
+            names.pop(norm, None)
+            for tri in self._trigrams(norm):
+                trigrams.get(tri, set()).discard(norm)
+
+    def load(self, guild, members):
+        """Replace a guild's members with (user, nick, name) tuples"""
+        self.drop(guild)
+        self.members[guild] = {}
+        for user, nick, name in members:
+            self.add(guild, user, nick, name)
+
+    def add(self, guild, user, nick, name):
+        """Add or update a member of the guild"""
+        self.remove(guild, user)
+        self.members.setdefault(guild, {})[user] = (nick, name)
+        self._index(guild, user, nick, name)
+
+    def remove(self, guild, user):
+        """Remove a member from the guild"""
+        old = self.members.get(guild, {}).pop(user, None)
+        if old is not None:
+            self._unindex(guild, user, *old)
+
+    def rename(self, user, name):
+        """Update a user's name in every guild they're in"""
+        for guild, members in self.members.items():
+            if user in members:
+                self.add(guild, user, members[user][0], name)
+
+    def drop(self, guild):
+        """Forget everything about a guild"""
+        self.members.pop(guild, None)
+        self.names.pop(guild, None)
+        self.trigrams.pop(guild, None)
+
+    def display(self, guild, user):
+        """Nick or name of the member, None if they aren't in the guild"""
+        member = self.members.get(guild, {}).get(user)
+        if member is None:
+            return None
+        return member[0] or member[1]
+
+    def display_many(self, guild, users):
+        """Nick or name of each member by id, None for anyone not in the guild"""
+        members = self.members.get(guild, {})
+        return {
+            user: (members[user][0] or members[user][1]) if user in members else None
+            for user in users
+        }
+
+    def _candidates(self, guild, query):
+        names = self.names.get(guild, {})
+        if len(query) < 3:
+            return list(names)
+        trigrams = self.trigrams.get(guild, {})
+        found = {}
+        for tri in self._trigrams(query):
+            for norm in trigrams.get(tri, ()):
+                found[norm] = found.get(norm, 0) + 1
+        return found
+
+    def find(self, guild, query):
+        """Id of the member best matching `query`: an exact name, then the
+        shortest name containing it, then the closest by shared trigrams"""
+        query = self.normalize(query)
+        names = self.names.get(guild, {})
+        if not query:
+            return None
+        if query in names:
+            return min(names[query])
+
+        candidates = self._candidates(guild, query)
+        containing = [norm for norm in candidates if query in norm]
+        if containing:
+            return min(names[min(containing, key=lambda norm: (len(norm), norm))])
+        if len(query) < 3 or not candidates:
+            return None
+
+        qtris = len(self._trigrams(query))
+
+        def score(norm):
+            shared = candidates[norm]
+            return shared / (qtris + len(self._trigrams(norm)) - shared)
+
+        best = max(candidates, key=score)
+        return min(names[best]) if score(best) >= self.MIN_SCORE else None
+
+
+class ResultCache:
+    """Query results keyed by (command, guild, user, windows)
+
+    Each guild has a generation that's bumped whenever its data is written,
+    results from an older generation are never served. Results can also get
+    a ttl for when they drift with time even without any writes.
+    """
+
+    MAX_CACHE = 1024
+
+    def __init__(self, max_cache=MAX_CACHE):
+        self.max_cache = max_cache
+        self.epoch = 0
+        self.generations = {}
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Cached result for the key, None if missing, stale, or expired"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            generation, expires, value = entry
+            if generation == self.generation(key[1]) and time() < expires:
+                self.hits += 1
+                return value
+            self.entries.pop(key, None)
+        self.misses += 1
+        return None
+
+    def generation(self, guild):
+        """Current generation of the guild, read it before running a query so
+        a write that lands while it runs isn't missed"""
+        return self.epoch, self.generations.get(guild, 0)
+
+    def put(self, key, value, ttl=None, generation=None):
+        """Cache a result for the key's guild at the generation it was queried
+        in, the current one if not given"""
+        if len(self.entries) >= self.max_cache:
+            self.entries.pop(next(iter(self.entries)), None)
+        expires = float("inf") if ttl is None else time() + ttl
+        if generation is None:
+            generation = self.generation(key[1])
+        self.entries[key] = (generation, expires, value)
+
+    def bump(self, *guilds):
+        """Invalidate everything cached for the guilds"""
+        for guild in guilds:
+            self.generations[guild] = self.generations.get(guild, 0) + 1
+
+    def clear(self):
+        """Invalidate everything, safe to call from another thread"""
+        self.epoch += 1
+
+    def stats(self):
+        """Hit and miss counts and the current size"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+class LRUCache:
+    """Bounded mapping that forgets the least recently used keys first"""
+
+    MAX_SIZE = 50_000
+
+    def __init__(self, max_size=MAX_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Value for the key, marking it recently used, or default if missing"""
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Set the key, dropping the least recently used one if full"""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        """Hit and miss counts and the current size"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+class WriteQueue:
+    """Rows written behind the events that produce them
+
+    Producers `put` rows and a single writer keeps calling `drain`, which
+    hands them to `write` a batch at a time as soon as a batch is full or
+    `delay` seconds after the last drain otherwise. Once `max_rows` are
+    waiting `put` blocks until the writer catches up, so a stalled database
+    slows the events down instead of growing the queue without bound.
+    """
+
+    BATCH = 500
+    DELAY = 0.25
+    MAX_ROWS = 20_000
+    LATENCIES = 100
+
+    def __init__(self, write, batch=BATCH, delay=DELAY, max_rows=MAX_ROWS):
+        self.write = write
+        self.batch = batch
+        self.delay = delay
+        self.max_rows = max_rows
+        self.rows = deque()
+        self.full = asyncio.Event()
+        self.space = asyncio.Event()
+        self.space.set()
+        self.peak = 0
+        self.flushes = 0
+        self.written = 0
+        self.waits = 0
+        self.failures = 0
+        # seconds taken by the most recent writes
+        self.latencies = deque(maxlen=self.LATENCIES)
+
+    def __len__(self):
+        return len(self.rows)
+
+    async def put(self, *rows):
+        """Queue rows, waiting for room while the queue is at its limit"""
+        while len(self.rows) >= self.max_rows:
+            self.waits += 1
+            self.space.clear()
+            await self.space.wait()
+        self.rows.extend(rows)
+        self.peak = max(self.peak, len(self.rows))
+        if len(self.rows) >= self.batch:
+            self.full.set()
+
+    def _take(self):
+        return [self.rows.popleft() for _ in range(min(self.batch, len(self.rows)))]
+
+    def _written(self, chunk, start):
+        self.latencies.append(perf_counter() - start)
+        self.flushes += 1
+        self.written += len(chunk)
+        self.space.set()
+
+    async def drain(self, blocker):
+        """Wait for a full batch or the delay, then write everything queued
+        through `blocker`, putting a batch back to retry if the write fails"""
+        try:
+            await asyncio.wait_for(self.full.wait(), self.delay)
+        except asyncio.TimeoutError:
+            pass
+        self.full.clear()
+        while self.rows:
+            chunk = self._take()
+            start = perf_counter()
+            try:
+                await blocker(self.write, chunk)
+            except SQLError as err:
+                self.failures += 1
+                self.rows.extendleft(reversed(chunk))
+                logger.warning("failed writing %s queued rows, will retry: %s", len(chunk), err)
+                return
+            self._written(chunk, start)
+
+    def flush(self):
+        """Write everything queued right away, for shutting down"""
+        while self.rows:
+            chunk = self._take()
+            start = perf_counter()
+            self.write(chunk)
+            self._written(chunk, start)
+
+    def stats(self):
+        """Queue depth, rows and batches written, and recent write latency"""
+        latencies = sorted(self.latencies)
+        return {
+            "depth": len(self.rows),
+            "peak": self.peak,
+            "flushes": self.flushes,
+            "written": self.written,
+            "waits": self.waits,
+            "failures": self.failures,
+            "median": latencies[len(latencies) // 2] if latencies else 0,
+            "max": latencies[-1] if latencies else 0,
+        }
+
+
 async def aget_json(session, url):
     """Get json from an async aiohttp GET request"""
     async with session.get(url) as res:
@@ -100,6 +491,10 @@ async def aget_json(session, url):
 TZNAME = "US/Eastern"
 TIMEZONE = timezone(TZNAME)
 
+HOUR_SECS = 60 * 60
+DAY_SECS = 24 * HOUR_SECS
+EPOCH = datetime(1970, 1, 1)
+
 
 def sec_to_human(secs):
     """Convert duration from seconds to days / hrs / mins / secs"""
@@ -133,15 +528,22 @@ class TimeTravel:
         return datetime.utcfromtimestamp(timestamp)
 
     @staticmethod
+    @lru_cache(maxsize=4096)
+    # pylint: disable=invalid-name
+    def utcoffset(tz, hour):
+        """Seconds to add to a utc timestamp to get local time for the
+        given epoch hour, cached since tz transitions happen on the hour"""
+        return int(datetime.fromtimestamp(hour * HOUR_SECS, tz=tz).utcoffset().total_seconds())
+
+    @classmethod
     # pylint: disable=invalid-name
-    def timeoffset(tz=TZNAME):
+    def timeoffset(cls, tz=TZNAME):
         """Get the hours and minutes to add to a loacal time to
         get it as a  naive utc time"""
-        off = datetime.now(timezone(tz)).strftime("%z")
-        mult = 1 if off[0] == "-" else -1
-        hour = int(off[1:3]) * mult
-        mins = int(off[3:5]) * mult
-        return hour, mins
+        off = cls.utcoffset(timezone(tz), int(cls.timestamp() // HOUR_SECS))
+        mult = 1 if off < 0 else -1
+        hour, mins = divmod(abs(off) // 60, 60)
+        return hour * mult, mins * mult
 
     @classmethod
     def fromstr(cls, date_string):
@@ -166,9 +568,14 @@ class TimeTravel:
     @staticmethod
     def week_day(year: int, week: int, weekday: int) -> str:
         """Generate YYYY-MM-DD from year, week number, day number"""
-        ywd = f"{year}-{week}-{weekday}"
-        iso_date = datetime.strptime(ywd, "%G-%V-%u")
-        return datetime.strftime(iso_date, "%Y-%m-%d")
+        return datetime.fromisocalendar(year, week, weekday).strftime("%Y-%m-%d")
+
+    @staticmethod
+    @lru_cache(maxsize=512)
+    def _week_dates(date_string: str) -> tuple[str]:
+        year, week, _ = datetime.strptime(date_string, "%Y-%m-%d").isocalendar()
+        monday = datetime.fromisocalendar(year, week, 1)
+        return tuple((monday + timedelta(days=day)).strftime("%Y-%m-%d") for day in range(7))
 
     @classmethod
     def week_dates(cls, date_string: str) -> list[str]:
@@ -179,23 +586,53 @@ class TimeTravel:
         following Thursday, Friday, Saturday, and Sunday. ISO standard starts the week
         on a Monday (1) and ends on Sunday (7).
         """
-        year, week, _ = datetime.strptime(date_string, "%Y-%m-%d").isocalendar()
-        return [
-            cls.week_day(year, week, 1),
-            cls.week_day(year, week, 2),
-            cls.week_day(year, week, 3),
-            cls.week_day(year, week, 4),
-            cls.week_day(year, week, 5),
-            cls.week_day(year, week, 6),
-            cls.week_day(year, week, 7),
-        ]
+        return list(cls._week_dates(date_string))
+
+    @staticmethod
+    @lru_cache(maxsize=4096)
+    def _daystr(day):
+        return (EPOCH + timedelta(days=day)).strftime("%Y-%m-%d")
+
+    @classmethod
+    def _sqlts(cls, ts, tz, offsets=None, days=None):
+        secs = floor(ts)
+        usecs = round((ts - secs) * 1_000_000)
+        if usecs == 1_000_000:
+            secs += 1
+            usecs = 0
+        hour = secs // HOUR_SECS
+        if offsets is None or (offset := offsets.get(hour)) is None:
+            offset = cls.utcoffset(tz, hour)
+            if offsets is not None:
+                offsets[hour] = offset
+        day, rem = divmod(secs + offset, DAY_SECS)
+        if days is None or (daystr := days.get(day)) is None:
+            daystr = cls._daystr(day)
+            if days is not None:
+                days[day] = daystr
+        hour, rem = divmod(rem, HOUR_SECS)
+        mins, secs = divmod(rem, 60)
+        return f"{daystr}T{hour:02d}:{mins:02d}:{secs:02d}.{usecs // 1000:03d}"
 
     @classmethod
     def sqlts(cls, ts):
         """Convert timestamp to sqlite database time string check"""
         if isinstance(ts, datetime):
             ts = ts.timestamp()
-        return datetime.fromtimestamp(ts, tz=cls.tz).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+        return cls._sqlts(ts, cls.tz)
+
+    @classmethod
+    def sqlts_many(cls, timestamps):
+        """Convert a sequence of timestamps to sqlite database time strings,
+        offsets and date strings are only looked up once per hour / day seen"""
+        tz = cls.tz
+        conv = cls._sqlts
+        offsets = {}
+        days = {}
+        return [
+            conv(ts.timestamp() if isinstance(ts, datetime) else ts, tz, offsets, days)
+            for ts in timestamps
+        ]
 
     @staticmethod
     def tsfromdiscord(ts):
@@ -213,9 +650,9 @@ class TimeTravel:
     def pretty_ts(cls, ts):
         """Return a pretty output for the timestamp"""
         val = cls.sqlts(ts)
-        date, time = val.split("T")
-        time = time.split(".")[0]
-        return f"{date} at {time}"
+        date, clock = val.split("T")
+        clock = clock.split(".")[0]
+        return f"{date} at {clock}"
 
     @classmethod
     def strptime(cls, date):
@@ -260,6 +697,18 @@ class ContextDB:
     """Sqlite DB for use with context libs"""
 
     SQL_TIMEOUT = 60.0
+    PRAGMAS = (
+        "PRAGMA cache_size = -16000",
+        "PRAGMA mmap_size = 268435456",
+        "PRAGMA temp_store = MEMORY",
+    )
+    WAL_PRAGMAS = ("PRAGMA synchronous = NORMAL",)
+    VACUUM_PAGES = 2000
+    ANALYSIS_LIMIT = 400
+    SNAPSHOT_ATTEMPTS = 3
+    SNAPSHOT_RETRY = 5.0
+    MIGRATION_CHUNK = 5000
+    CHUNKED = re.compile(r"--\s*deferred\s+chunked\s+by\s+(\w+)\.(\w+)", re.IGNORECASE)
 
     def __init__(self, dbfile, setup_filename, readonly=False):
         self.readonly = readonly
@@ -268,6 +717,7 @@ class ContextDB:
             raise ValueError("No database to open")
         self.setup_filename = setup_filename
         self.conn = None
+        self.wal = None
 
     def setup(self):
         """setup the voice database"""
@@ -278,6 +728,124 @@ class ContextDB:
         with self as db:
             db.executescript(sql_script)
 
+        self.migrate()
+
+    def _migrations(self):
+        """Migration files for this database, `migrations/<setup name>/NNNN_name.sql`"""
+        directory = calc_path(Path("migrations", Path(self.setup_filename).stem))
+        if not directory.is_dir():
+            return []
+        found = []
+        for path in sorted(directory.glob("*.sql")):
+            version, _, name = path.stem.partition("_")
+            script = path.read_text(encoding="utf-8")
+            deferred = script.lstrip().lower().startswith("-- deferred")
+            chunked = self.CHUNKED.match(script.lstrip())
+            found.append((int(version), name, script, deferred, chunked and chunked.groups()))
+        return sorted(found)
+
+    @staticmethod
+    def _statements(script):
+        statement = ""
+        for line in script.splitlines(keepends=True):
+            statement += line
+            if complete_statement(statement):
+                yield statement.strip()
+                statement = ""
+        if statement.strip():
+            yield statement.strip()
+
+    def _chunks(self, table, column):
+        """Keyset bounds `(low, high]` over `column` with MIGRATION_CHUNK rows each
+
+        Every row sharing a value is in the same chunk, the query for the next
+        bound runs in its own short read so nothing is held between chunks.
+        """
+        with self as db:
+            low = db.execute(f"SELECT min({column}) - 1 AS low FROM {table}").fetchone()["low"]
+        while low is not None:
+            with self as db:
+                row = db.execute(
+                    f"SELECT {column} AS high FROM {table} WHERE {column} > ? "
+                    f"ORDER BY {column} LIMIT 1 OFFSET ?",
+                    (low, self.MIGRATION_CHUNK - 1),
+                ).fetchone()
+                if row is None:
+                    row = db.execute(
+                        f"SELECT max({column}) AS high FROM {table} WHERE {column} > ?", (low,)
+                    ).fetchone()
+            if row["high"] is None:
+                return
+            yield low, row["high"]
+            low = row["high"]
+
+    def _run_deferred(self, script, chunked):
+        for statement in self._statements(script):
+            if chunked and ":low" in statement:
+                for low, high in self._chunks(*chunked):
+                    with self as db:
+                        db.execute(statement, {"low": low, "high": high})
+            else:
+                with self as db:
+                    db.execute(statement)
+
+    def migrate(self, deferred=False):
+        """Apply pending migrations in version order
+
+        Regular migrations run in a single transaction along with their version
+        record. Migrations starting with a `-- deferred` comment (long index builds,
+        backfills) are skipped unless `deferred` is set, and then run one statement
+        per transaction so the write lock is only held for a statement at a time,
+        which means they need to be safe to rerun if interrupted part way. With
+        `-- deferred chunked by Table.column` the statements using `:low` and
+        `:high` run once per keyset chunk of that column instead of over the
+        whole table at once.
+        """
+        with self as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS schema_version(
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied REAL NOT NULL
+                )
+                """
+            )
+            applied = {row["version"] for row in db.execute("SELECT version FROM schema_version")}
+
+        done = []
+        for version, name, script, is_deferred, chunked in self._migrations():
+            if version in applied or (is_deferred and not deferred):
+                continue
+            logger.info("applying migration %s_%s to %s", version, name, self.filename)
+            if is_deferred:
+                self._run_deferred(script, chunked)
+                with self as db:
+                    db.execute(
+                        "INSERT INTO schema_version VALUES (?,?,?)",
+                        (version, name, time()),
+                    )
+            else:
+                quoted = name.replace("'", "''")
+                with self as db:
+                    db.executescript(
+                        f"BEGIN;\n{script}\n;\n"
+                        f"INSERT INTO schema_version VALUES ({version}, '{quoted}', {time()});\n"
+                        "COMMIT;"
+                    )
+            done.append(version)
+        return done
+
+    def _tune(self):
+        for pragma in self.PRAGMAS:
+            self.conn.execute(pragma)
+        if not self.wal:
+            mode = self.conn.execute("PRAGMA journal_mode").fetchone()[0]
+            self.wal = mode.lower() == "wal"
+        if self.wal:
+            for pragma in self.WAL_PRAGMAS:
+                self.conn.execute(pragma)
+
     def open(self):
         """Open a connection to the database and return a cursor"""
         self.conn = (
@@ -285,22 +853,127 @@ class ContextDB:
             if self.readonly
             else connect(self.filename, timeout=self.SQL_TIMEOUT)
         )
+        self._tune()
         self.conn.row_factory = DictRow
         return self.conn.cursor()
 
-    def close(self):
-        """Close connection to the database"""
+    def close(self, rollback=False):
+        """Close connection to the database, committing unless rolling back"""
         if not self.readonly:
-            self.conn.commit()
+            if rollback:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
         return self.conn.close()
 
     def __enter__(self):
         return self.open()
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
+        # nothing from a block that raised is kept, a migration and its
+        # version record are committed together or not at all
+        self.close(rollback=exc_type is not None)
         return exc_type is None
 
+    def optimize(self):
+        """Refresh the query planner statistics, an ANALYZE the first time and
+        the cheaper PRAGMA optimize after that, both only sampling each index"""
+        with self as db:
+            db.execute(f"PRAGMA analysis_limit = {int(self.ANALYSIS_LIMIT)}")
+            analyzed = db.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+            ).fetchone()
+            if analyzed:
+                db.execute("PRAGMA optimize")
+            else:
+                db.execute("ANALYZE")
+        return "optimize" if analyzed else "analyze"
+
+    def checkpoint(self, mode="TRUNCATE"):
+        """Checkpoint the WAL back into the database file"""
+        if not self.wal:
+            return None
+        with self as db:
+            row = db.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return row["busy"], row["log"], row["checkpointed"]
+
+    def reclaim(self, pages=VACUUM_PAGES):
+        """Free up to `pages` unused pages, None if the database isn't using
+        incremental auto vacuum (see `enable_incremental`)"""
+        with self as db:
+            auto_vacuum = db.execute("PRAGMA auto_vacuum").fetchone()["auto_vacuum"]
+            if auto_vacuum != 2:
+                return None
+            before = db.execute("PRAGMA freelist_count").fetchone()["freelist_count"]
+            # each step of the pragma frees a page and execute() only takes the
+            # first, executescript() runs it to the end
+            db.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            after = db.execute("PRAGMA freelist_count").fetchone()["freelist_count"]
+        return before - after
+
+    def enable_incremental(self):
+        """Switch the database over to incremental auto vacuum, which takes a
+        full VACUUM: it holds the write lock for the whole rewrite and needs
+        about the database's size again in free disk, so it's only ever run
+        on request. False if it was already incremental."""
+        with self as db:
+            if db.execute("PRAGMA auto_vacuum").fetchone()["auto_vacuum"] == 2:
+                return False
+            db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            db.execute("VACUUM")
+        return True
+
+    def maintain(self, pages=VACUUM_PAGES):
+        """Run the periodic upkeep on the database"""
+        return {
+            "planner": self.optimize(),
+            "reclaimed": self.reclaim(pages),
+            "checkpoint": self.checkpoint(),
+        }
+
+    def snapshot(self, destination, attempts=SNAPSHOT_ATTEMPTS):
+        """Copy the live database to `destination` with sqlite's online backup
+
+        The copy is a single step: under WAL its read transaction doesn't hold
+        up writers, while a backup done a few pages at a time starts over
+        whenever anything is written between steps and may never finish. If
+        the database is too busy to read it's retried, up to `attempts` times.
+        """
+        for attempt in range(1, attempts + 1):
+            source = connect(self.filename, timeout=self.SQL_TIMEOUT)
+            target = connect(destination)
+            try:
+                source.backup(target, pages=-1)
+                return destination
+            except SQLError as err:
+                if attempt == attempts:
+                    raise
+                logger.warning("snapshot of %s failed, retrying: %s", self.filename, err)
+            finally:
+                target.close()
+                source.close()
+            sleep(self.SNAPSHOT_RETRY)
+        return None
+
+    def stats(self):
+        """Sizes and page info for the database"""
+        with self as db:
+            info = {
+                pragma: db.execute(f"PRAGMA {pragma}").fetchone()[pragma]
+                for pragma in (
+                    "page_size",
+                    "page_count",
+                    "freelist_count",
+                    "auto_vacuum",
+                    "journal_mode",
+                )
+            }
+        dbfile = Path(self.filename)
+        walfile = dbfile.with_name(f"{dbfile.name}-wal")
+        info["db_size"] = dbfile.stat().st_size if dbfile.exists() else 0
+        info["wal_size"] = walfile.stat().st_size if walfile.exists() else 0
+        return info
+
 
 # # https://stackoverflow.com/a/65882269
 # def threadable(func):
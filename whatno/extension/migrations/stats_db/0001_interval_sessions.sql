@@ -0,0 +1,25 @@
+-- Voice sessions are written to History once when they close, with an endtime
+-- derived from their start and duration. Sessions still in progress live in
+-- OpenSession and get their duration from the heartbeat in Timestamps.
+
+CREATE TABLE IF NOT EXISTS OpenSession(
+    user INTEGER NOT NULL,
+    guild INTEGER NOT NULL,
+    channel INTEGER NOT NULL,
+    voicestate TEXT NOT NULL,
+    starttime TIMESTAMP NOT NULL,
+    h_time TEXT,
+    UNIQUE(user, channel, voicestate, starttime)
+);
+
+ALTER TABLE History ADD COLUMN endtime REAL GENERATED ALWAYS AS (starttime + duration) VIRTUAL;
+
+CREATE VIEW IF NOT EXISTS VoiceHistory AS
+SELECT user, guild, channel, voicestate, starttime, duration
+FROM History
+UNION ALL
+SELECT
+    o.user, o.guild, o.channel, o.voicestate, o.starttime,
+    max(coalesce(hb.ts, o.starttime) - o.starttime, 0) AS duration
+FROM OpenSession AS o
+LEFT JOIN Timestamps AS hb ON hb.name = 'heartbeat';
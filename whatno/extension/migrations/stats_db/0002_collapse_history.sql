@@ -0,0 +1,20 @@
+-- deferred chunked by History.user
+-- The old model rewrote an open session's duration every minute and could leave
+-- several rows per session, keep only the longest one of each. A session is
+-- one user's, so this runs a chunk of users at a time.
+
+DELETE FROM History
+WHERE rowid IN (
+    SELECT rowid
+    FROM (
+        SELECT
+            rowid,
+            row_number() OVER (
+                PARTITION BY user, channel, voicestate, h_time
+                ORDER BY duration DESC, rowid DESC
+            ) AS num
+        FROM History
+        WHERE user > :low AND user <= :high
+    )
+    WHERE num > 1
+);
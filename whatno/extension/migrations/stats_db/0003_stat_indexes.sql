@@ -0,0 +1,14 @@
+-- deferred
+-- Covering indexes for the leaderboard (guild + voicestate over a time range,
+-- grouped by user) and per user stats (user + guild over a time range, grouped
+-- by voicestate) so neither has to touch the table rows.
+
+CREATE INDEX IF NOT EXISTS History_guild_state_start
+ON History(guild, voicestate, starttime, user, duration, channel);
+
+CREATE INDEX IF NOT EXISTS History_user_guild_start
+ON History(user, guild, starttime, voicestate, duration, channel);
+
+INSERT INTO Timestamps
+SELECT 'early', min(starttime) FROM History HAVING min(starttime) IS NOT NULL
+ON CONFLICT(name) DO UPDATE SET ts = min(ts, excluded.ts);
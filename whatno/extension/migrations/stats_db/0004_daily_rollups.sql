@@ -0,0 +1,23 @@
+-- Per day, user, guild, and voicestate totals of closed sessions, bucketed by
+-- the utc day the session started on. Kept up to date as sessions close so the
+-- leaderboards and user stats don't have to sum every History row.
+
+CREATE TABLE IF NOT EXISTS DailyVoice(
+    day INTEGER NOT NULL,
+    user INTEGER NOT NULL,
+    guild INTEGER NOT NULL,
+    voicestate TEXT NOT NULL,
+    duration REAL NOT NULL,
+    sessions INTEGER NOT NULL,
+    UNIQUE(guild, voicestate, day, user)
+);
+
+CREATE INDEX IF NOT EXISTS DailyVoice_user_guild_day
+ON DailyVoice(user, guild, day, voicestate, duration);
+
+CREATE VIEW IF NOT EXISTS OpenVoice AS
+SELECT
+    o.user, o.guild, o.channel, o.voicestate, o.starttime,
+    max(coalesce(hb.ts, o.starttime) - o.starttime, 0) AS duration
+FROM OpenSession AS o
+LEFT JOIN Timestamps AS hb ON hb.name = 'heartbeat';
@@ -0,0 +1,13 @@
+-- deferred chunked by History.user
+-- Fill DailyVoice from every closed session. Sessions that closed since the
+-- table was created are already counted in History, so the totals are replaced
+-- rather than added to. Each row is one user's, so this runs a chunk of users
+-- at a time.
+
+INSERT INTO DailyVoice
+SELECT CAST(starttime / 86400 AS INTEGER) AS day, user, guild, voicestate, sum(duration), count(*)
+FROM History
+WHERE user > :low AND user <= :high
+GROUP BY day, user, guild, voicestate
+ON CONFLICT(guild, voicestate, day, user) DO UPDATE
+SET duration = excluded.duration, sessions = excluded.sessions;
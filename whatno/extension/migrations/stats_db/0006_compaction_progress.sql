@@ -0,0 +1,11 @@
+-- Progress of the History compaction so an interrupted run picks up where it
+-- left off. `cursor` is the last user whose rows were compacted, NULL when no
+-- run is in progress.
+
+CREATE TABLE IF NOT EXISTS Compaction(
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    started REAL NOT NULL,
+    cursor INTEGER,
+    removed INTEGER NOT NULL DEFAULT 0,
+    finished REAL
+);
@@ -0,0 +1,20 @@
+-- Seconds each pair of users spent in the same voice channel, stored in both
+-- directions so a user's neighbours are a single range of the primary key.
+-- Tracking starts now, the time before is backfilled once from History by
+-- the stats cog using the `copresence` timestamp as the cut off.
+
+CREATE TABLE IF NOT EXISTS CoPresence(
+    guild INTEGER NOT NULL,
+    user INTEGER NOT NULL,
+    other INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY(guild, user, other)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS Backfill(
+    name TEXT PRIMARY KEY,
+    cursor INTEGER,
+    finished REAL
+);
+
+INSERT OR IGNORE INTO Timestamps VALUES ('copresence', (julianday('now') - 2440587.5) * 86400.0);
@@ -0,0 +1,32 @@
+-- Activity (playing, streaming, listening, ...) sessions from presence updates.
+-- Closed sessions are written to Activity once and added to the running
+-- per user totals in ActivityTotal, open ones live in OpenActivity and get
+-- closed at the activity heartbeat after a restart.
+
+CREATE TABLE IF NOT EXISTS Activity(
+    user INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    starttime REAL NOT NULL,
+    duration REAL NOT NULL,
+    UNIQUE(user, kind, name, starttime)
+);
+
+CREATE TABLE IF NOT EXISTS OpenActivity(
+    user INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    starttime REAL NOT NULL,
+    PRIMARY KEY(user, kind, name)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ActivityTotal(
+    user INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    duration REAL NOT NULL,
+    sessions INTEGER NOT NULL,
+    PRIMARY KEY(user, kind, name)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS ActivityTotal_name ON ActivityTotal(name, kind, user, duration);
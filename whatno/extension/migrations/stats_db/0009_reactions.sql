@@ -0,0 +1,47 @@
+-- Reactions currently on guild messages, one row per (message, user, emoji).
+-- ReactEmoji and ReactUser are running counters kept in step by triggers, so
+-- only rows actually added or removed (not ignored duplicates) move them and
+-- the leaderboards never have to scan Reaction.
+
+CREATE TABLE IF NOT EXISTS Reaction(
+    message INTEGER NOT NULL,
+    user INTEGER NOT NULL,
+    emoji TEXT NOT NULL,
+    guild INTEGER NOT NULL,
+    channel INTEGER NOT NULL,
+    author INTEGER,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY(message, user, emoji)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ReactEmoji(
+    guild INTEGER NOT NULL,
+    emoji TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY(guild, emoji)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS ReactUser(
+    guild INTEGER NOT NULL,
+    user INTEGER NOT NULL,
+    given INTEGER NOT NULL,
+    received INTEGER NOT NULL,
+    PRIMARY KEY(guild, user)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS Reaction_added AFTER INSERT ON Reaction
+BEGIN
+    INSERT INTO ReactEmoji VALUES (new.guild, new.emoji, 1)
+    ON CONFLICT(guild, emoji) DO UPDATE SET count = count + 1;
+    INSERT INTO ReactUser VALUES (new.guild, new.user, 1, 0)
+    ON CONFLICT(guild, user) DO UPDATE SET given = given + 1;
+    INSERT INTO ReactUser SELECT new.guild, new.author, 0, 1 WHERE new.author IS NOT NULL
+    ON CONFLICT(guild, user) DO UPDATE SET received = received + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS Reaction_removed AFTER DELETE ON Reaction
+BEGIN
+    UPDATE ReactEmoji SET count = count - 1 WHERE guild = old.guild AND emoji = old.emoji;
+    UPDATE ReactUser SET given = given - 1 WHERE guild = old.guild AND user = old.user;
+    UPDATE ReactUser SET received = received - 1 WHERE guild = old.guild AND user = old.author;
+END;
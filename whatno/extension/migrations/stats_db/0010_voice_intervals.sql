@@ -0,0 +1,46 @@
+-- R*Tree over when each closed voice session started and ended so "who was
+-- in voice at" only visits the sessions overlapping that moment. The tree
+-- keeps whole seconds (rounded outwards), the exact times ride along as
+-- auxiliary columns to filter on. Triggers keep it in step with History as
+-- sessions are written and compacted, matching on the session rather than
+-- the History rowid since a VACUUM is free to renumber those.
+
+CREATE VIRTUAL TABLE IF NOT EXISTS VoiceSpan USING rtree_i32(
+    id,
+    start,
+    end,
+    +user INTEGER,
+    +guild INTEGER,
+    +channel INTEGER,
+    +starttime REAL,
+    +endtime REAL
+);
+
+CREATE TRIGGER IF NOT EXISTS History_span_added AFTER INSERT ON History
+WHEN new.voicestate = 'voice'
+BEGIN
+    INSERT INTO VoiceSpan VALUES (
+        NULL,
+        CAST(new.starttime AS INTEGER),
+        CAST(new.starttime + new.duration AS INTEGER) + 1,
+        new.user,
+        new.guild,
+        new.channel,
+        new.starttime,
+        new.starttime + new.duration
+    );
+END;
+
+CREATE TRIGGER IF NOT EXISTS History_span_removed AFTER DELETE ON History
+WHEN old.voicestate = 'voice'
+BEGIN
+    DELETE FROM VoiceSpan WHERE id IN (
+        SELECT id FROM VoiceSpan
+        WHERE start = CAST(old.starttime AS INTEGER)
+        AND end = CAST(old.starttime + old.duration AS INTEGER) + 1
+        AND user = old.user AND channel = old.channel AND starttime = old.starttime
+    );
+END;
+
+-- sessions written from here on are added by the trigger, the rest are backfilled
+INSERT OR IGNORE INTO Timestamps SELECT 'voicespan', coalesce(max(rowid), 0) FROM History;
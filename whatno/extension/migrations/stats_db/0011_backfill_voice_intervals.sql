@@ -0,0 +1,18 @@
+-- deferred
+-- Fill VoiceSpan from the voice sessions closed before it existed, the ones
+-- closed since were added by the trigger. Backfilled spans are keyed by the
+-- negated History rowid, out of the way of the trigger's ids, so a rerun
+-- replaces them instead of adding them twice.
+
+INSERT OR REPLACE INTO VoiceSpan
+SELECT
+    -rowid,
+    CAST(starttime AS INTEGER),
+    CAST(starttime + duration AS INTEGER) + 1,
+    user,
+    guild,
+    channel,
+    starttime,
+    starttime + duration
+FROM History
+WHERE voicestate = 'voice' AND rowid <= (SELECT ts FROM Timestamps WHERE name = 'voicespan');
@@ -0,0 +1,333 @@
+"""SQL used by the stats cog"""
+
+from collections import namedtuple
+
+from .helpers import DAY_SECS, TimeTravel
+
+MSG_INSERT = "INSERT OR IGNORE INTO Message VALUES (?,?,?,?,?,?,?,?,?,?,?,?)"
+# a chunk's messages and its checkpoint are committed together, an unset
+# cursor (a chunk with no messages) keeps the last one
+HISTORY_MARK = """
+    INSERT INTO Backfill VALUES (?1, ?2, ?3)
+    ON CONFLICT(name) DO UPDATE SET cursor = coalesce(?2, cursor), finished = ?3
+"""
+MESSAGE_AUTHORS = """
+    SELECT message, min(user) AS user FROM Message
+    WHERE message IN (SELECT value FROM json_each(?)) AND user IS NOT NULL
+    GROUP BY message
+"""
+HISTORY_INSERT = """
+    INSERT INTO History VALUES (?,?,?,?,?,?,?,?)
+    ON CONFLICT(user, channel, voicestate, starttime) DO UPDATE
+    SET duration = max(duration, excluded.duration)
+"""
+OPEN_INSERT = """
+    INSERT INTO OpenSession VALUES (?,?,?,?,?,?)
+    ON CONFLICT(user, channel, voicestate, starttime) DO UPDATE SET h_time = excluded.h_time
+    RETURNING rowid
+"""
+OPEN_DELETE = """
+    DELETE FROM OpenSession
+    WHERE rowid = ?1
+       OR (?1 IS NULL AND user = ?2 AND channel = ?3 AND voicestate = ?4 AND starttime = ?5)
+"""
+EARLY = """
+    INSERT INTO Timestamps VALUES ('early', ?)
+    ON CONFLICT(name) DO UPDATE SET ts = min(ts, excluded.ts)
+"""
+ROLLUP_ADD = """
+    INSERT INTO DailyVoice VALUES (CAST(?1 / 86400 AS INTEGER), ?2, ?3, ?4, ?5, 1)
+    ON CONFLICT(guild, voicestate, day, user) DO UPDATE
+    SET duration = duration + excluded.duration, sessions = sessions + 1
+"""
+COPRESENCE_ADD = """
+    INSERT INTO CoPresence VALUES (?, ?, ?, ?)
+    ON CONFLICT(guild, user, other) DO UPDATE SET seconds = seconds + excluded.seconds
+"""
+COPRESENCE_FRIENDS = """
+    SELECT other, seconds FROM CoPresence
+    WHERE guild = ? AND user = ?
+    ORDER BY seconds DESC
+    LIMIT 10
+"""
+COPRESENCE_HISTORY = """
+    SELECT guild, channel, user, starttime, min(endtime, :cut) AS endtime
+    FROM History
+    WHERE voicestate = 'voice' AND starttime < :cut AND channel > :cursor
+    ORDER BY channel
+"""
+# voice sessions overlapping [:start, :end], through the R*Tree once it's
+# backfilled or a scan of History before then, plus the open sessions
+SpanQuery = namedtuple("SpanQuery", ["indexed", "raw"])
+VOICE_SPANS = SpanQuery(
+    """
+    SELECT user, channel, starttime, endtime FROM VoiceSpan
+    WHERE start <= :end AND end >= :start
+    AND guild = :guild AND starttime <= :end AND endtime > :start {channel}
+    """,
+    """
+    SELECT user, channel, starttime, endtime FROM History
+    WHERE voicestate = 'voice'
+    AND guild = :guild AND starttime <= :end AND endtime > :start {channel}
+    """,
+)
+OPEN_SPANS = """
+    UNION ALL
+    SELECT user, channel, starttime, :now AS endtime FROM OpenSession
+    WHERE voicestate = 'voice'
+    AND guild = :guild AND starttime <= :end AND :now > :start {channel}
+"""
+HEATMAP_VOICE = """
+    SELECT starttime, starttime + duration AS endtime FROM VoiceHistory
+    WHERE guild = :guild AND voicestate = 'voice' {user}
+"""
+HEATMAP_TXT = """
+    SELECT timestamp FROM Message
+    WHERE guild = :guild AND event = 'create' {user}
+"""
+ACTIVITY_INSERT = "INSERT OR IGNORE INTO Activity VALUES (?,?,?,?,?)"
+ACTIVITY_TOTAL = """
+    INSERT INTO ActivityTotal VALUES (?, ?, ?, ?, 1)
+    ON CONFLICT(user, kind, name) DO UPDATE
+    SET duration = duration + excluded.duration, sessions = sessions + 1
+"""
+ACTIVITY_OPEN = "INSERT OR REPLACE INTO OpenActivity VALUES (?,?,?,?)"
+ACTIVITY_CLOSE = "DELETE FROM OpenActivity WHERE user = ? AND kind = ? AND name = ?"
+ACTIVITY_HEARTBEAT = """
+    INSERT INTO Timestamps VALUES ('activity', ?)
+    ON CONFLICT(name) DO UPDATE SET ts = excluded.ts
+"""
+ACTIVITY_RECOVER = """
+    SELECT
+        o.user, o.kind, o.name, o.starttime,
+        max(coalesce(hb.ts, o.starttime) - o.starttime, 0) AS duration
+    FROM OpenActivity AS o
+    LEFT JOIN Timestamps AS hb ON hb.name = 'activity'
+"""
+# the author comes from the event when given, otherwise from the messages seen
+REACT_ADD = """
+    INSERT OR IGNORE INTO Reaction VALUES (?1, ?2, ?3, ?4, ?5, coalesce(?6, (
+        SELECT user FROM Message WHERE message = ?1 AND user IS NOT NULL LIMIT 1
+    )), ?7)
+"""
+REACT_REMOVE = "DELETE FROM Reaction WHERE message = ? AND user = ? AND emoji = ?"
+REACT_CLEAR = "DELETE FROM Reaction WHERE message = ?"
+REACT_CLEAR_EMOJI = "DELETE FROM Reaction WHERE message = ? AND emoji = ?"
+REACT_EMOJI_TOP = """
+    SELECT emoji, count FROM ReactEmoji
+    WHERE guild = ? AND count > 0
+    ORDER BY count DESC
+    LIMIT 10
+"""
+REACT_USER_TOP = """
+    SELECT user, {column} AS count FROM ReactUser
+    WHERE guild = ? AND {column} > 0
+    ORDER BY {column} DESC
+    LIMIT 10
+"""
+# {filter} narrows the members' totals, open sessions count up to the heartbeat
+ACTIVITY_TOTALS = """
+    SELECT {group}, sum(duration) AS total
+    FROM (
+        SELECT user, kind, name, duration FROM ActivityTotal
+        UNION ALL
+        SELECT o.user, o.kind, o.name, max(hb.ts - o.starttime, 0)
+        FROM OpenActivity AS o
+        JOIN Timestamps AS hb ON hb.name = 'activity'
+    )
+    WHERE {filter}
+    GROUP BY {group}
+    ORDER BY total DESC
+    LIMIT 10
+"""
+HEARTBEAT = """
+    INSERT INTO Timestamps VALUES ('heartbeat', ?)
+    ON CONFLICT(name) DO UPDATE SET ts = excluded.ts
+"""
+RECOVER_ROLLUPS = """
+    INSERT INTO DailyVoice
+    SELECT CAST(starttime / 86400 AS INTEGER), user, guild, voicestate, duration, 1
+    FROM OpenVoice
+    WHERE true
+    ON CONFLICT(guild, voicestate, day, user) DO UPDATE
+    SET duration = duration + excluded.duration, sessions = sessions + 1
+"""
+RECOVER_SESSIONS = """
+    INSERT INTO History
+    SELECT
+        o.user, o.guild, o.channel, o.voicestate, o.starttime,
+        max(coalesce(hb.ts, o.starttime) - o.starttime, 0), False, o.h_time
+    FROM OpenSession AS o
+    LEFT JOIN Timestamps AS hb ON hb.name = 'heartbeat'
+    WHERE true
+    ON CONFLICT(user, channel, voicestate, starttime) DO UPDATE
+    SET duration = max(duration, excluded.duration)
+"""
+COMPRESS_CHUNK_END = """
+    SELECT user FROM History WHERE user > ? ORDER BY user LIMIT 1 OFFSET ?
+"""
+COMPRESS_DELETE = """
+    DELETE FROM History
+    WHERE rowid IN (
+        SELECT rowid
+        FROM (
+            SELECT
+                rowid,
+                row_number() OVER (
+                    PARTITION BY user, channel, voicestate, h_time
+                    ORDER BY duration DESC, rowid DESC
+                ) AS num
+            FROM History
+            WHERE user > ?1 AND user <= ?2
+        )
+        WHERE num > 1
+    )
+"""
+COMPRESS_START = """
+    INSERT INTO Compaction VALUES (1, ?, NULL, 0, NULL)
+    ON CONFLICT(id) DO UPDATE SET started = excluded.started, cursor = NULL, removed = 0
+"""
+COMPRESS_MARK = """
+    INSERT INTO Timestamps VALUES ('compress', ?)
+    ON CONFLICT(name) DO UPDATE SET ts = excluded.ts
+"""
+# migration that backfills DailyVoice, rollups are only used once it's applied
+ROLLUP_VERSION = 5
+# migration that backfills VoiceSpan, the interval index is only used once it's applied
+SPAN_VERSION = 11
+TotalsQuery = namedtuple("TotalsQuery", ["rollup", "raw"])
+# {columns} is one conditional sum per window, {edges} the partial first day of each
+TOP_TOTALS = TotalsQuery(
+    rollup="""
+        SELECT user, {columns}
+        FROM (
+            SELECT 'rollup' AS src, user, day, NULL AS starttime, duration FROM DailyVoice
+            WHERE guild = :guild AND voicestate = 'voice' AND day > :min_day
+            UNION ALL
+            SELECT 'edge', user, CAST(starttime / 86400 AS INTEGER), starttime, duration
+            FROM History
+            WHERE guild = :guild AND voicestate = 'voice' AND ({edges})
+            UNION ALL
+            SELECT 'open', user, NULL, starttime, duration FROM OpenVoice
+            WHERE guild = :guild AND voicestate = 'voice' AND starttime > :min_since
+        )
+        GROUP BY user
+        HAVING w0 > 0
+        ORDER BY w0 DESC
+        LIMIT 10
+    """,
+    raw="""
+        SELECT user, {columns}
+        FROM VoiceHistory
+        WHERE guild = :guild AND voicestate = 'voice' AND starttime > :min_since
+        GROUP BY user
+        HAVING w0 > 0
+        ORDER BY w0 DESC
+        LIMIT 10
+    """,
+)
+USER_TOTALS = TotalsQuery(
+    rollup="""
+        SELECT voicestate, {columns}
+        FROM (
+            SELECT 'rollup' AS src, voicestate, day, NULL AS starttime, duration FROM DailyVoice
+            WHERE user = :user AND guild = :guild AND day > :min_day
+            UNION ALL
+            SELECT 'edge', voicestate, CAST(starttime / 86400 AS INTEGER), starttime, duration
+            FROM History
+            WHERE user = :user AND guild = :guild AND ({edges})
+            UNION ALL
+            SELECT 'open', voicestate, NULL, starttime, duration FROM OpenVoice
+            WHERE user = :user AND guild = :guild AND starttime > :min_since
+        )
+        GROUP BY voicestate
+    """,
+    raw="""
+        SELECT voicestate, {columns}
+        FROM VoiceHistory
+        WHERE user = :user AND guild = :guild AND starttime > :min_since
+        GROUP BY voicestate
+    """,
+)
+ROLLUP_COLUMN = """
+    sum(CASE WHEN (src = 'rollup' AND day > :day{idx})
+        OR (src = 'edge' AND day = :day{idx} AND starttime > :since{idx})
+        OR (src = 'open' AND starttime > :since{idx})
+    THEN duration ELSE 0 END) AS w{idx}
+"""
+ROLLUP_EDGE = "(starttime > :since{idx} AND starttime < :day_end{idx})"
+RAW_COLUMN = "sum(CASE WHEN starttime > :since{idx} THEN duration ELSE 0 END) AS w{idx}"
+
+
+def totals_query(query, windows, rollups, **params):
+    """Sql and params for the totals of every window in one pass, `w0`, `w1`, ...
+    in the order given, from the daily rollups plus the raw rows of each window's
+    partial first day and any open sessions, or from the raw history if the
+    rollups aren't backfilled yet. A window of None gets the totals for all time."""
+    for idx, days in enumerate(windows):
+        since = -1 if days is None else TimeTravel.tsinpast(days)
+        day = -1 if since == -1 else int(since // DAY_SECS)
+        params[f"since{idx}"] = since
+        params[f"day{idx}"] = day
+        params[f"day_end{idx}"] = (day + 1) * DAY_SECS
+    params["min_since"] = min(params[f"since{idx}"] for idx in range(len(windows)))
+    params["min_day"] = min(params[f"day{idx}"] for idx in range(len(windows)))
+
+    idxs = range(len(windows))
+    if rollups:
+        sql = query.rollup.format(
+            columns=", ".join(ROLLUP_COLUMN.format(idx=idx) for idx in idxs),
+            edges=" OR ".join(ROLLUP_EDGE.format(idx=idx) for idx in idxs),
+        )
+    else:
+        sql = query.raw.format(columns=", ".join(RAW_COLUMN.format(idx=idx) for idx in idxs))
+    return sql, params
+
+USER_EARLY = """
+    SELECT min(coalesce(hist, open), coalesce(open, hist)) as early
+    FROM (
+        SELECT
+            (SELECT min(starttime) FROM History WHERE user = :user AND guild = :guild) AS hist,
+            (SELECT min(starttime) FROM OpenSession WHERE user = :user AND guild = :guild) AS open
+    )
+"""
+
+# a user's voice sessions for the local days they touch, an open session counts
+# through now, read through the user covering index
+VOICE_STREAKS = """
+    SELECT starttime, starttime + duration AS endtime FROM History
+    WHERE user = :user AND guild = :guild AND voicestate = 'voice' AND duration > 0
+    UNION ALL
+    SELECT starttime, :now FROM OpenSession
+    WHERE user = :user AND guild = :guild AND voicestate = 'voice'
+"""
+# quarter totals from local midnight, whole utc days from the rollups and the
+# rest of the first one from History
+VOICE_RANK = """
+    WITH totals AS (
+        SELECT user, sum(duration) AS total
+        FROM (
+            SELECT user, duration FROM DailyVoice
+            WHERE guild = :guild AND voicestate = 'voice' AND day > :day
+            UNION ALL
+            SELECT user, duration FROM History
+            WHERE guild = :guild AND voicestate = 'voice'
+                AND starttime >= :since AND starttime < (:day + 1) * 86400
+            UNION ALL
+            SELECT user, duration FROM OpenVoice
+            WHERE guild = :guild AND voicestate = 'voice' AND starttime >= :since
+        )
+        GROUP BY user
+        HAVING total > 0
+    )
+    SELECT * FROM (
+        SELECT
+            user,
+            total,
+            rank() OVER (ORDER BY total DESC) AS place,
+            cume_dist() OVER (ORDER BY total DESC) AS top,
+            count(*) OVER () AS members
+        FROM totals
+    )
+    WHERE user = :user
+"""
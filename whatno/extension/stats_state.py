@@ -0,0 +1,194 @@
+"""In memory voice, co-presence, presence, and reaction state for the stats cog"""
+
+from array import array
+from collections import namedtuple
+from itertools import combinations, groupby
+
+PRESENCE_MAX_PENDING = 5000
+REACT_MAX_PENDING = 1000
+
+STATES = ["voice", "mute", "deaf", "stream", "video"]
+
+VoiceCon = namedtuple("VoiceCon", ["user", "guild", "channel"])
+STATE_BITS = {state: 1 << idx for idx, state in enumerate(STATES)}
+ALL_STATES = (1 << len(STATES)) - 1
+# indexes of the set bits for every possible mask
+MASK_INDEXES = tuple(
+    tuple(idx for idx in range(len(STATES)) if mask >> idx & 1) for mask in range(ALL_STATES + 1)
+)
+
+
+class Voice:
+    """Active states of a user in a channel as a bitmask over STATES,
+    with the start time of each state in a parallel array"""
+
+    __slots__ = ("mask", "starts")
+
+    def __init__(self, mask=0, starts=None):
+        self.mask = mask
+        self.starts = starts if starts is not None else array("d", bytes(8 * len(STATES)))
+
+    @classmethod
+    def start(cls, state, timestamp):
+        """Every state active in a discord voice state starting at `timestamp`"""
+        mask = (
+            STATE_BITS["voice"]
+            | bool(state.self_mute) << 1
+            | bool(state.self_deaf) << 2
+            | bool(state.self_stream) << 3
+            | bool(state.self_video) << 4
+        )
+        return cls(mask, array("d", (timestamp,) * len(STATES)))
+
+    def active(self, state):
+        """If the named state is active"""
+        return bool(self.mask & STATE_BITS[state])
+
+    def __repr__(self):
+        active = {STATES[idx]: self.starts[idx] for idx in MASK_INDEXES[self.mask]}
+        return f"Voice({active})"
+
+
+NO_VOICE = Voice()
+
+
+class CoPresence:
+    """Seconds pairs of users spend in the same voice channel
+
+    Every time a channel's occupants change, or the pending totals are
+    drained, each pair in the channel is credited the time since its last
+    change. Pending totals are keyed by (guild, user, other) with user < other.
+    """
+
+    def __init__(self):
+        # (guild, channel) -> [users, last change]
+        self.channels = {}
+        self.pending = {}
+
+    def _credit(self, key, now):
+        users, last = self.channels[key]
+        if len(users) > 1 and now > last:
+            elapsed = now - last
+            for user, other in combinations(sorted(users), 2):
+                pair = (key[0], user, other)
+                self.pending[pair] = self.pending.get(pair, 0) + elapsed
+        self.channels[key][1] = max(now, last)
+
+    def join(self, guild, channel, user, now):
+        """User joined the channel at `now`"""
+        key = (guild, channel)
+        if key in self.channels:
+            self._credit(key, now)
+        else:
+            self.channels[key] = [set(), now]
+        self.channels[key][0].add(user)
+
+    def leave(self, guild, channel, user, now):
+        """User left the channel at `now`"""
+        key = (guild, channel)
+        if key not in self.channels:
+            return
+        self._credit(key, now)
+        users = self.channels[key][0]
+        users.discard(user)
+        if not users:
+            del self.channels[key]
+
+    def drain(self, now):
+        """Credit every occupied channel up to `now` and hand over the totals"""
+        for key in self.channels:
+            self._credit(key, now)
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def restore(self, pending):
+        """Add back drained totals that couldn't be written"""
+        for pair, seconds in pending.items():
+            self.pending[pair] = self.pending.get(pair, 0) + seconds
+
+
+class Presence:
+    """Open activity sessions per user, presence updates are coalesced per
+    user until the changes are taken
+
+    Activities are (kind, name) pairs. Between flushes a user only has the
+    activities they currently have with when each showed up, and when any
+    that went away did, so a burst of updates (or the same update from every
+    shared guild) collapses into one change per activity.
+    """
+
+    def __init__(self, max_pending=PRESENCE_MAX_PENDING):
+        self.max_pending = max_pending
+        # user -> {(kind, name): start}
+        self.open = {}
+        # user -> ({activity: first seen}, {activity: went away}) since the last flush
+        self.latest = {}
+        # (opened, closed) taken by a flush that failed to write them
+        self.unwritten = ([], [])
+
+    def update(self, user, activities, now):
+        """Record the user's current activities, True once the pending
+        updates are full and need to be flushed"""
+        if user in self.latest:
+            present, gone = self.latest[user]
+        else:
+            present, gone = dict.fromkeys(self.open.get(user, ()), now), {}
+            self.latest[user] = (present, gone)
+        for key in present.keys() - activities:
+            del present[key]
+            gone[key] = now
+        for key in activities - present.keys():
+            present[key] = now
+        return len(self.latest) >= self.max_pending
+
+    def changes(self):
+        """Sessions opened (user, kind, name, start) and closed
+        (user, kind, name, start, duration) since the last call, after any
+        that failed to write"""
+        latest, self.latest = self.latest, {}
+        opened, closed = self.unwritten
+        self.unwritten = ([], [])
+        for user, (present, gone) in latest.items():
+            current = self.open.pop(user, {})
+            for key in current.keys() - present.keys():
+                start = current.pop(key)
+                closed.append((user, *key, start, max(gone[key] - start, 0)))
+            for key in present.keys() - current.keys():
+                current[key] = present[key]
+                opened.append((user, *key, present[key]))
+            if current:
+                self.open[user] = current
+        # an open that never got written and has closed since only needs the close
+        ends = {closing[:4] for closing in closed}
+        return [opening for opening in opened if opening not in ends], closed
+
+    def restore(self, opened, closed):
+        """Changes a flush couldn't write, they go out first with the next one"""
+        self.unwritten = (opened + self.unwritten[0], closed + self.unwritten[1])
+
+
+class Reactions:
+    """Reaction events waiting to be written, kept in the order they came in
+    so a remove or clear always lands after the adds it undoes"""
+
+    def __init__(self, max_pending=REACT_MAX_PENDING):
+        self.max_pending = max_pending
+        # (sql, params) in arrival order
+        self.pending = []
+
+    def push(self, sql, params):
+        """Queue an event, True once the queue is full and needs to be flushed"""
+        self.pending.append((sql, params))
+        return len(self.pending) >= self.max_pending
+
+    def drain(self):
+        """Take the queued events as runs of (sql, [params]) for executemany"""
+        pending, self.pending = self.pending, []
+        return [
+            (sql, [params for _, params in run])
+            for sql, run in groupby(pending, key=lambda event: event[0])
+        ]
+
+    def restore(self, batches):
+        """Put drained runs that couldn't be written back ahead of newer events"""
+        self.pending[:0] = [(sql, params) for sql, rows in batches for params in rows]
@@ -33,6 +33,7 @@ class WhatnoBot(Bot):  # pylint: disable=too-many-ancestors
         self.prefix = prefix
         logger.debug("Environment: %s", self.env)
         self.storage = Path(storage or self.env.path("STORAGE", "storage")).resolve()
+        self.databases = {}
 
         super().__init__(
             command_prefix=when_mentioned_or(prefix),
@@ -52,6 +53,15 @@ class WhatnoBot(Bot):  # pylint: disable=too-many-ancestors
         logger.debug("func return: %s", future)
         return future
 
+    def register_database(self, name, opener):
+        """Register a cog's database so it can be maintained and backed up
+
+        `opener` returns a new ContextDB each call, a ContextDB holds a single
+        connection so one can't be shared by operations in different threads.
+        """
+        logger.debug("registering database %s: %s", name, opener().filename)
+        self.databases[name] = opener
+
     def load_cogs(self, cogs):
         """Load the cogs found in the extension folder"""
         logger.info("loading cogs: %s", cogs)